@@ -0,0 +1,34 @@
+--deduplicated trips passing every cleaning rule
+--incremental runs only recompute the (month, color) pairs that received newly loaded files
+with staged as (
+    select * from {{ ref('stg_trips_yellow') }}
+    union all
+    select * from {{ ref('stg_trips_green') }}
+)
+
+{% if is_incremental() %}
+, changed as (
+    select distinct pickup_month, color
+    from staged
+    where loaded_at > (select coalesce(max(loaded_at), '1900-01-01'::timestamp) from {{ this }})
+)
+{% endif %}
+
+select
+    s.color,
+    s.passenger_count,
+    s.trip_distance,
+    s.pickup_datetime,
+    s.dropoff_datetime,
+    date_diff('second', s.pickup_datetime, s.dropoff_datetime) as trip_duration_sec,
+    s.pickup_month,
+    max(s.loaded_at) as loaded_at
+from staged s
+{% if is_incremental() %}
+join changed c on c.pickup_month = s.pickup_month and c.color = s.color
+{% endif %}
+where s.passenger_count > 0
+  and s.trip_distance > 0
+  and s.trip_distance <= 100
+  and date_diff('second', s.pickup_datetime, s.dropoff_datetime) between 0 and 86400
+group by all
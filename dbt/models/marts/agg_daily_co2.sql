@@ -0,0 +1,22 @@
+--co2 per color and pickup day
+{% if is_incremental() %}
+with changed as (
+    select distinct pickup_month, color
+    from {{ ref('fct_trips_enriched') }}
+    where loaded_at > (select coalesce(max(loaded_at), '1900-01-01'::timestamp) from {{ this }})
+)
+{% endif %}
+
+select
+    t.color,
+    t.pickup_month,
+    t.pickup_datetime::date  as pickup_date,
+    count(*)                 as trips,
+    sum(t.trip_co2_kgs)      as co2_kgs,
+    max(t.trip_co2_kgs)      as max_trip_co2_kgs,
+    max(t.loaded_at)         as loaded_at
+from {{ ref('fct_trips_enriched') }} t
+{% if is_incremental() %}
+join changed c on c.pickup_month = t.pickup_month and c.color = t.color
+{% endif %}
+group by all
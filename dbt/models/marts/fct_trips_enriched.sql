@@ -0,0 +1,33 @@
+--cleaned trips with co2, speed and calendar columns, rebuilt per changed (month, color)
+--a changed emissions factor needs `dbt run --full-refresh`
+{% if is_incremental() %}
+with changed as (
+    select distinct pickup_month, color
+    from {{ ref('int_trips_cleaned') }}
+    where loaded_at > (select coalesce(max(loaded_at), '1900-01-01'::timestamp) from {{ this }})
+)
+{% endif %}
+
+select
+    t.color,
+    t.passenger_count,
+    t.trip_distance,
+    t.pickup_datetime,
+    t.dropoff_datetime,
+    t.trip_duration_sec,
+    t.trip_distance * e.co2_grams_per_mile / 1000.0           as trip_co2_kgs,
+    t.trip_distance / nullif(t.trip_duration_sec / 3600.0, 0) as avg_mph,
+    hour(t.pickup_datetime)                                   as hour_of_day,
+    dayofweek(t.pickup_datetime)                              as day_of_week,   -- 0=Sun..6=Sat
+    week(t.pickup_datetime)                                   as week_of_year,
+    month(t.pickup_datetime)                                  as month_of_year,
+    t.pickup_month,
+    t.loaded_at
+from {{ ref('int_trips_cleaned') }} t
+join {{ ref('stg_emissions') }} e
+  on e.color = t.color
+ and (e.valid_from is null or t.pickup_datetime >= e.valid_from)
+ and (e.valid_to is null or t.pickup_datetime < e.valid_to)
+{% if is_incremental() %}
+join changed c on c.pickup_month = t.pickup_month and c.color = t.color
+{% endif %}
@@ -0,0 +1,7 @@
+--emissions factors per taxi color and validity range, valid_to is exclusive and NULL bounds are open
+select
+    color,
+    valid_from,
+    valid_to,
+    co2_grams_per_mile
+from {{ source('taxi', 'emissions_dim') }}
@@ -0,0 +1,12 @@
+--yellow trips with the pickup month and the time their source file was (re)loaded
+select
+    t.color,
+    t.passenger_count,
+    t.trip_distance,
+    t.pickup_datetime,
+    t.dropoff_datetime,
+    date_trunc('month', t.pickup_datetime)::date as pickup_month,
+    m.loaded_at
+from {{ source('taxi', 'trips_all') }} t
+join {{ source('taxi', 'load_manifest') }} m on m.file_name = t.source_file
+where t.color = 'yellow'
@@ -1,5 +1,16 @@
-import duckdb
+import sys
 import logging
+import argparse
+import pandas as pd
+from datetime import date
+
+from approx import approx_answers
+from db import get_connection
+from lake import lake_exists, lake_source
+from executor import run_parallel
+from plots import render_plots
+from profiling import StageReport, track_query
+from result_cache import ResultCache, cached_execute, data_version
 
 logging.basicConfig(
     filename = "logs/analysis.log",
@@ -12,195 +23,275 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-#analyze and aggregate data from trips_enriched table
-def analyze_files():
+DOW_NAMES = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+COLORS = ["yellow", "green"]
+
+#co2 per color x day x hour from the rollup scripts/transform.py maintains, everything else is derived from it
+ROLLUP_SQL = """
+SELECT
+  color,
+  pickup_date  AS d,
+  hour_of_day  AS h,
+  co2_kgs      AS co2,
+  max_co2_kgs  AS max_co2,
+  trips
+FROM co2_rollup_hourly
+WHERE color = ?
+"""
+
+#the same rollup computed from the parquet lake scripts/export.py writes; the color and
+#year/month filters are pushed into the hive partition listing, so other files are never opened
+LAKE_ROLLUP_SQL = """
+SELECT
+  color,
+  DATE(pickup_datetime) AS d,
+  hour_of_day           AS h,
+  SUM(trip_co2_kgs)     AS co2,
+  MAX(trip_co2_kgs)     AS max_co2,
+  COUNT(*)              AS trips
+FROM {source}
+WHERE color = ?
+"""
+
+
+#sql and parameters for one color's rollup, optionally limited to months = (first, last) month starts
+def rollup_query(color, source="db", months=None):
+    params = [color]
+    if source == "lake":
+        sql = LAKE_ROLLUP_SQL.format(source=lake_source())
+        if months:
+            sql += "  AND year * 100 + month BETWEEN ? AND ?\n"
+            params += [m.year * 100 + m.month for m in months]
+        return sql + "GROUP BY ALL\n", params
+    sql = ROLLUP_SQL
+    if months:
+        sql += "  AND pickup_date >= ? AND pickup_date < ? + INTERVAL 1 MONTH\n"
+        params += list(months)
+    return sql, params
+
+
+#pulling one color's day x hour rollup into a dataframe (~24 rows per day)
+def fetch_rollup(con, color, report=None, source="db", months=None, cache=None):
+    sql, params = rollup_query(color, source, months)
+    with track_query(report, con, f"rollup {color}"):
+        rollup = cached_execute(cache, con, sql, params).df()
+    rollup["d"] = pd.to_datetime(rollup["d"])
+    return rollup
+
+
+#the per (color, month) reservoir sample and its strata for --approx, a few thousand rows per year
+SAMPLE_SQL = """
+SELECT month_start, pickup_datetime, co2
+FROM trips_sample
+WHERE color = ?
+"""
+STRATA_SQL = """
+SELECT month_start, population, sample_size, max_co2
+FROM trips_sample_strata
+WHERE color = ?
+"""
+#(day, hour) cells with trips, the denominators of the averages
+CELLS_SQL = """
+SELECT pickup_date AS d, hour_of_day AS h
+FROM co2_rollup_hourly
+WHERE color = ?
+"""
+
+
+#pulling one color's sample, strata and active days/hours, optionally limited to months = (first, last)
+def fetch_sample(con, color, report=None, months=None, cache=None):
+    month_filter = "  AND month_start BETWEEN ? AND ?\n" if months else ""
+    cells_filter = "  AND pickup_date >= ? AND pickup_date < ? + INTERVAL 1 MONTH\n" if months else ""
+    params = [color, *months] if months else [color]
+    with track_query(report, con, f"sample {color}"):
+        sample = cached_execute(cache, con, SAMPLE_SQL + month_filter, params).df()
+    strata = cached_execute(cache, con, STRATA_SQL + month_filter, params).df()
+    if strata.empty:
+        raise ValueError(f"no trip sample for {color}, run scripts/transform.py first")
+    cells = cached_execute(cache, con, f"""
+        SELECT list(DISTINCT d ORDER BY d) AS days, histogram(h) AS hour_cells
+        FROM ({CELLS_SQL + cells_filter})
+    """, params).fetchall()[0]
+    days, hour_cells = cells[0], pd.Series(cells[1])
+    return sample, strata, days, hour_cells
+
+
+#heaviest and lightest rows of an averaged series, as (key, avg) tuples like ORDER BY ... LIMIT 1
+def extremes(series):
+    return (series.idxmax(), series.max()), (series.idxmin(), series.min())
+
+
+#every per-color answer computed in memory from that color's rollup
+def color_answers(hourly):
+
+    #daily totals, the base for day of week / week / month averages
+    daily = hourly.groupby("d")["co2"].sum()
+    dates = daily.index
+    dow_num = (dates.dayofweek + 1) % 7   #0=Sun..6=Sat
+    iso = dates.isocalendar()
+
+    #average co2 of each hour of the day across all days
+    hour_avg = hourly.groupby("h")["co2"].mean()
+    #average daily co2 per day of the week
+    dow_avg = daily.groupby(dow_num).mean()
+    #weeks and months are summed within each calendar year, then averaged across years
+    #(calendar, not iso, year: dec 29-31 stay in their year's week 1 as in the original query)
+    week_avg = daily.groupby([dates.year, iso["week"].values]).sum().groupby(level=1).mean()
+    month_avg = daily.groupby([dates.year, dates.month]).sum().groupby(level=1).mean()
+
+    heaviest_hour, lightest_hour = extremes(hour_avg)
+    heaviest_dow, lightest_dow = extremes(dow_avg)
+    heaviest_week, lightest_week = extremes(week_avg)
+    heaviest_month, lightest_month = extremes(month_avg)
+
+    return {
+        "largest_trip": hourly["max_co2"].max(),
+        "heaviest_hour": heaviest_hour,
+        "lightest_hour": lightest_hour,
+        #(dow_num, dow_name, avg) like the original day of week query
+        "heaviest_dow": (heaviest_dow[0], DOW_NAMES[heaviest_dow[0]], heaviest_dow[1]),
+        "lightest_dow": (lightest_dow[0], DOW_NAMES[lightest_dow[0]], lightest_dow[1]),
+        "heaviest_week": heaviest_week,
+        "lightest_week": lightest_week,
+        "heaviest_month": heaviest_month,
+        "lightest_month": lightest_month,
+    }
+
+
+#one analysis task per color, run concurrently on read-only cursors; returns {color: answers}
+#cache: optional ResultCache the per-color queries are read through
+def analyze_colors(con, report=None, source="db", months=None, approx=False, cache=None):
+    if approx:
+        tasks = {
+            f"analysis_{color}": (lambda cursor, color=color:
+                                  approx_answers(*fetch_sample(cursor, color, report, months, cache)))
+            for color in COLORS
+        }
+    else:
+        tasks = {
+            f"analysis_{color}": (lambda cursor, color=color:
+                                  color_answers(fetch_rollup(cursor, color, report, source, months, cache)))
+            for color in COLORS
+        }
+    results = run_parallel(con, tasks)
+    for result in results.values():
+        if report is not None:
+            report.set_total(f"{result.name}_seconds", round(result.seconds, 6))
+        if result.error is not None:
+            raise result.error
+    return {color: results[f"analysis_{color}"].value for color in COLORS}
+
+
+#printing the --approx answers, each average with its 95% interval and a flag when the
+#heaviest/lightest group cannot be told apart from the runner-up
+def print_approx(answers):
+    month_names = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+    labels = {
+        "hour": ("Hours of Day", "hour", lambda key: key),
+        "dow": ("Day of Week", "DoW", lambda key: DOW_NAMES[key]),
+        "week": ("Week of Year", "week", lambda key: int(key)),
+        "month": ("Month of Year", "month", lambda key: month_names[int(key) - 1]),
+    }
+    print("APPROXIMATE ANSWERS (stratified sample, 95% confidence intervals)")
+    for color in COLORS:
+        a = answers[color]
+        print(f"{color.upper()}: {a['sampled_trips']:,} sampled of {a['population']:,} trips")
+    print()
+
+    print("Largest single carbon producing trip (exact, from the sample strata)")
+    for color in COLORS:
+        print(f"{color.upper():<6}: {answers[color]['largest_trip']}")
+    print()
+
+    for name, (title, unit, label) in labels.items():
+        print(f"{title} with heaviest and lightest average CO2 emissions")
+        for color in COLORS:
+            for rank in ("heaviest", "lightest"):
+                r = answers[color][f"{rank}_{name}"]
+                flag = "" if r["separable"] else "  [not separable from runner-up]"
+                print(f"{color.upper():<6} {rank} {unit}: {label(r['key'])} "
+                      f"(avg={r['avg']:.3f} kg, 95% CI {r['low']:.3f}-{r['high']:.3f}){flag}")
+        print()
+
+
+#analyze and aggregate data from the co2_rollup_hourly table, or from the parquet lake with source="lake"
+#approx=True answers from the stratified trip sample instead, with confidence intervals
+#results of the queries are cached on disk per data version unless use_cache=False
+def analyze_files(profile: bool = False, source: str = "db", months=None, approx: bool = False,
+                  use_cache: bool = True):
+    report = StageReport("analysis", profile)
     try:
-        # Connect to local DuckDB instance
-        con = duckdb.connect(
-    database="/mnt/c/Users/krngz/OneDrive - University of Virginia/DS 3022 - Data Engineering/ds3022-data-project-1/emissions.duckdb",
-    read_only=True,
-    config={
-        "threads": 1,
-        "memory_limit": "1GB",
-        "temp_directory": "/tmp",
-    },
-)
+        if source == "lake":
+            #the lake needs no database file at all, so it never waits on the pipeline's writer
+            if not lake_exists():
+                raise FileNotFoundError("no parquet lake found, run scripts/export.py first")
+            con = get_connection(database=":memory:")
+        else:
+            # Connect to local DuckDB instance
+            con = get_connection(read_only=True)
         #logging connection
-        logger.info("Connected to DuckDB instance for ANALYSIS")
-
-        #daily totals subquery to be used in other queries
-        daily_total_sql = """
-        SELECT
-          DATE(pickup_datetime)                              AS d,
-          CAST(strftime(DATE(pickup_datetime), '%w') AS INT) AS dow_num,   -- 0=Sun..6=Sat
-          strftime(DATE(pickup_datetime), '%a')              AS dow_name,  -- Sun..Sat
-          EXTRACT(week  FROM DATE(pickup_datetime))          AS week_of_year, -- 1..53
-          EXTRACT(month FROM DATE(pickup_datetime))          AS month_num,    -- 1..12
-          SUM(trip_co2_kgs) AS day_co2
-        FROM trips_enriched
-        WHERE color = ?
-        GROUP BY 1,2,3,4,5
-        """
-
-        #day of the week averages daily co2, ordered by highest or lowest
-        dow_agg_sql = """
-        WITH daily AS ({daily})
-        SELECT
-        dow_num, dow_name,
-        AVG(day_co2) AS avg_co2
-        FROM daily
-        GROUP BY 1,2
-        ORDER BY avg_co2 {direction}
-        LIMIT 1
-        """
-
-        #sums daily totals into weeks and averages those weeks, ordered by highest or lowest
-        week_agg_sql = """
-        WITH daily AS ({daily}),
-        weekly AS (
-        SELECT week_of_year, SUM(day_co2) AS week_co2
-        FROM daily
-        GROUP BY week_of_year
-        )
-        SELECT week_of_year, AVG(week_co2) AS avg_week_co2
-        FROM weekly
-        GROUP BY week_of_year
-        ORDER BY avg_week_co2 {direction}
-        LIMIT 1
-        """
-        #sums daily totals into months and averages those months, ordered by highest or lowest
-        month_agg_sql = """
-        WITH daily AS ({daily}),
-        monthly AS (
-        SELECT month_num, SUM(day_co2) AS month_co2
-        FROM daily
-        GROUP BY month_num
-        )
-        SELECT month_num, AVG(month_co2) AS avg_month_co2
-        FROM monthly
-        GROUP BY month_num
-        ORDER BY avg_month_co2 {direction}
-        LIMIT 1
-        """
-
-        #using for plotting, gives total co2 per month (not an average) for line chart
-        month_totals_sqlL = """
-        WITH daily AS ({daily})
-        SELECT month_num, SUM(day_co2) AS month_total_co2
-        FROM daily
-        GROUP BY month_num
-        ORDER BY month_num
-        """
-
-        #largest single carbon producing trip per taxi color
-        largest_carbon_yellow = con.execute("""
-        SELECT MAX(trip_co2_kgs) FROM trips_enriched
-        WHERE color='yellow';
-        """).fetchone()[0]
-
-        largest_carbon_green = con.execute("""
-        SELECT MAX(trip_co2_kgs) FROM trips_enriched
-        WHERE color='green';        
-        """).fetchone()[0]
-
-        #heaviest and lightest hour per taxi color
-        heaviest_hour_yellow = con.execute("""
-        WITH hourly AS (
-        SELECT DATE(pickup_datetime) AS d, hour_of_day AS h, SUM(trip_co2_kgs) AS co2
-        FROM trips_enriched
-        WHERE color='yellow'
-        GROUP BY 1,2
-        ),
-        avg_hour AS (
-        SELECT h AS hour_of_day, AVG(co2) AS avg_co2
-        FROM hourly
-        GROUP BY 1
-        )
-        SELECT hour_of_day, avg_co2
-        FROM avg_hour
-        ORDER BY avg_co2 DESC
-        LIMIT 1;
-        """).fetchone()  #gives (hour_of_day, avg_co2)
-
-        lightest_hour_yellow = con.execute("""
-        WITH hourly AS (
-        SELECT DATE(pickup_datetime) AS d, hour_of_day AS h, SUM(trip_co2_kgs) AS co2
-        FROM trips_enriched
-        WHERE color='yellow'
-        GROUP BY 1,2
-        ),
-        avg_hour AS (
-        SELECT h AS hour_of_day, AVG(co2) AS avg_co2
-        FROM hourly
-        GROUP BY 1
-        )
-        SELECT hour_of_day, avg_co2
-        FROM avg_hour
-        ORDER BY avg_co2 ASC
-        LIMIT 1;
-        """).fetchone()
-
-        heaviest_hour_green = con.execute("""
-        WITH hourly AS (
-        SELECT DATE(pickup_datetime) AS d, hour_of_day AS h, SUM(trip_co2_kgs) AS co2
-        FROM trips_enriched
-        WHERE color='green'
-        GROUP BY 1,2
-        ),
-        avg_hour AS (
-        SELECT h AS hour_of_day, AVG(co2) AS avg_co2
-        FROM hourly
-        GROUP BY 1
-        )
-        SELECT hour_of_day, avg_co2
-        FROM avg_hour
-        ORDER BY avg_co2 DESC
-        LIMIT 1;
-        """).fetchone()
-
-        lightest_hour_green = con.execute("""
-        WITH hourly AS (
-        SELECT DATE(pickup_datetime) AS d, hour_of_day AS h, SUM(trip_co2_kgs) AS co2
-        FROM trips_enriched
-        WHERE color='green'
-        GROUP BY 1,2
-        ),
-        avg_hour AS (
-        SELECT h AS hour_of_day, AVG(co2) AS avg_co2
-        FROM hourly
-        GROUP BY 1
-        )
-        SELECT hour_of_day, avg_co2
-        FROM avg_hour
-        ORDER BY avg_co2 ASC
-        LIMIT 1;
-        """).fetchone()
-
-        #day of week, week, month heaviest and lightest averages, plus month totals for plotting
+        logger.info("Connected to DuckDB instance for ANALYSIS (source=%s, months=%s)", source, months)
+
+        #repeated runs on unchanged data read the query results back from the result cache
+        cache = None
+        if use_cache:
+            version = data_version(con, source)
+            if version is None:
+                logger.info("No data version recorded yet, result cache not used")
+            else:
+                cache = ResultCache(version)
+
+        #yellow and green read the pre-aggregated rollup and derive their answers in parallel
+        answers = analyze_colors(con, report, source, months, approx, cache)
+        if cache is not None:
+            report.set_total("cache_hits", cache.hits)
+            report.set_total("cache_misses", cache.misses)
+            logger.info("Result cache: %s hits, %s misses (data version %s)", cache.hits, cache.misses, cache.version)
+
+        #decade charts of the whole rollup, re-rendered only when the rollup changed
+        plot_status = {}
+        if source == "db" and not approx:
+            try:
+                with report.step("plots"):
+                    plot_status = render_plots(con)
+            except Exception as e:
+                print(f"Plotting failed: {e}")
+                logger.error(f"Plotting failed: {e}")
+        con.close()
 
-        #YELLOW
-        heaviest_dow_yellow   = con.execute(dow_agg_sql.format(daily=daily_total_sql,  direction="DESC"), ["yellow"]).fetchone()
-        lightest_dow_yellow   = con.execute(dow_agg_sql.format(daily=daily_total_sql,  direction="ASC"),  ["yellow"]).fetchone()
-        heaviest_week_yellow  = con.execute(week_agg_sql.format(daily=daily_total_sql, direction="DESC"), ["yellow"]).fetchone()
-        lightest_week_yellow  = con.execute(week_agg_sql.format(daily=daily_total_sql, direction="ASC"),  ["yellow"]).fetchone()
-        heaviest_month_yellow = con.execute(month_agg_sql.format(daily=daily_total_sql, direction="DESC"), ["yellow"]).fetchone()
-        lightest_month_yellow = con.execute(month_agg_sql.format(daily=daily_total_sql, direction="ASC"),  ["yellow"]).fetchone()
-        yellow_month_totals   = dict(con.execute(month_totals_sql.format(daily=daily_total_sql), ["yellow"]).fetchall())
-
-        # GREEN
-        heaviest_dow_green   = con.execute(dow_agg_sql.format(daily=daily_total_sql,  direction="DESC"), ["green"]).fetchone()
-        lightest_dow_green   = con.execute(dow_agg_sql.format(daily=daily_total_sql,  direction="ASC"),  ["green"]).fetchone()
-        heaviest_week_green  = con.execute(week_agg_sql.format(daily=daily_total_sql, direction="DESC"), ["green"]).fetchone()
-        lightest_week_green  = con.execute(week_agg_sql.format(daily=daily_total_sql, direction="ASC"),  ["green"]).fetchone()
-        heaviest_month_green = con.execute(month_agg_sql.format(daily=daily_total_sql, direction="DESC"), ["green"]).fetchone()
-        lightest_month_green = con.execute(month_agg_sql.format(daily=daily_total_sql, direction="ASC"),  ["green"]).fetchone()
-        green_month_totals   = dict(con.execute(month_totals_sql.format(daily=daily_total_sql), ["green"]).fetchall())
+        if approx:
+            print_approx(answers)
+            for color in COLORS:
+                logger.info("Approximate answers %s: %s", color.upper(), answers[color])
+            logger.info("Completed approximate analysis successfully.")
+            return True
 
+        yellow = answers["yellow"]
+        green = answers["green"]
 
+        largest_carbon_yellow = yellow["largest_trip"]
+        largest_carbon_green  = green["largest_trip"]
 
+        heaviest_hour_yellow  = yellow["heaviest_hour"]
+        lightest_hour_yellow  = yellow["lightest_hour"]
+        heaviest_hour_green   = green["heaviest_hour"]
+        lightest_hour_green   = green["lightest_hour"]
 
+        #YELLOW
+        heaviest_dow_yellow   = yellow["heaviest_dow"]
+        lightest_dow_yellow   = yellow["lightest_dow"]
+        heaviest_week_yellow  = yellow["heaviest_week"]
+        lightest_week_yellow  = yellow["lightest_week"]
+        heaviest_month_yellow = yellow["heaviest_month"]
+        lightest_month_yellow = yellow["lightest_month"]
 
-        con.close()
+        # GREEN
+        heaviest_dow_green   = green["heaviest_dow"]
+        lightest_dow_green   = green["lightest_dow"]
+        heaviest_week_green  = green["heaviest_week"]
+        lightest_week_green  = green["lightest_week"]
+        heaviest_month_green = green["heaviest_month"]
+        lightest_month_green = green["lightest_month"]
 
         #printing helper for month names
         def month_name(m):  # 1..12
@@ -237,35 +328,11 @@ def analyze_files():
         print(f"GREEN  lightest month: {month_name(lightest_month_green[0])} (avg={lightest_month_green[1]:.3f} kg)\n")
 
         
-        #attempting to plot
-        try: 
-            import matplotlib.pyplot as plt
-            months = list(range(1,13))
-            y_vals = [yellow_month_totals.get(m,0) for m in months]
-            g_vals = [green_month_totals.get(m,0)  for m in months]
-            labels = [month_name(m) for m in months]
-
-            plt.figure(figsize=(10,5))
-            plt.plot(months, y_vals, marker='o', label='Yellow')
-            plt.plot(months, g_vals, marker="o", label='Green')
-            plt.xticks(months, labels)
-            plt.xlabel("Month")
-            plt.ylabel("Total CO₂ (kg)")
-            plt.title("Monthly Taxi CO₂ Totals by Color")
-            plt.legend()
-            plt.tight_layout()
-            out_path = "outputs/monthly_co2_by_color.png"
-            plt.savefig(out_path, dpi=150)
-            plt.close()
-            print(f"Saved plot to {out_path}")
-
-
-        except Exception as e:
-            print(f"An error occurred: {e}")
-            logger.error(f"An error occurred: {e}")
-        
+        for path, state in plot_status.items():
+            print(f"Saved plot to {path}" if state == "rendered" else f"Plot unchanged, kept {path}")
+
         #logging to file
-            logger.info("Largest single trip CO2 (kg): YELLOW=%s, GREEN=%s", largest_carbon_yellow, largest_carbon_green)
+        logger.info("Largest single trip CO2 (kg): YELLOW=%s, GREEN=%s", largest_carbon_yellow, largest_carbon_green)
 
         logger.info("Hours (avg CO2): YELLOW heaviest=(hour=%s, avg=%s), lightest=(hour=%s, avg=%s)",
                     heaviest_hour_yellow[0], heaviest_hour_yellow[1],
@@ -295,14 +362,38 @@ def analyze_files():
                     month_name(heaviest_month_green[0]), heaviest_month_green[1],
                     month_name(lightest_month_green[0]), lightest_month_green[1])
 
-        logger.info("Saved plot to outputs/monthly_co2_by_color.png")
+        for path, state in plot_status.items():
+            logger.info("Plot %s: %s", state, path)
         logger.info("Completed analysis successfully.")
-
+        return True
 
     except Exception as e:
         print(f"An error occurred: {e}")
         logger.error(f"An error occurred: {e}")
-    
+        return False
+
+    finally:
+        logger.info("Run report written to %s", report.write())
+
 
 if __name__ == "__main__":
-    analyze_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Report CO2 analysis from the rollup tables")
+    parser.add_argument("--profile", action="store_true", help="include duckdb query profiles in the run report")
+    parser.add_argument("--source", choices=["db", "lake"], default="db",
+                        help="read the co2_rollup_hourly table or the exported parquet lake")
+    parser.add_argument("--start-month", help="first month to analyze, YYYY-MM (needs --end-month)")
+    parser.add_argument("--end-month", help="last month to analyze, YYYY-MM (needs --start-month)")
+    parser.add_argument("--approx", action="store_true",
+                        help="answer from the stratified trip sample with confidence intervals (db source only)")
+    parser.add_argument("--no-cache", action="store_true", help="recompute every query instead of using the result cache")
+    args = parser.parse_args()
+    if args.approx and args.source == "lake":
+        parser.error("--approx reads the sample tables in the database, not the lake")
+    if bool(args.start_month) != bool(args.end_month):
+        parser.error("--start-month and --end-month go together")
+    months = None
+    if args.start_month:
+        months = (date.fromisoformat(f"{args.start_month}-01"), date.fromisoformat(f"{args.end_month}-01"))
+    ok = analyze_files(profile=args.profile, source=args.source, months=months, approx=args.approx,
+                       use_cache=not args.no_cache)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+
+#approximate analysis answers from the stratified trip sample scripts/transform.py keeps
+#(trips_sample: up to SAMPLE_SIZE random trips per color x month, trips_sample_strata: how many
+#trips each stratum holds). every average is a stratified estimate of a total divided by the
+#number of calendar units it covers, reported with a normal-approximation confidence interval
+#the units are the days/hours that have trips (from co2_rollup_hourly, ~24 rows per day), the
+#same denominators the exact answers average over
+
+SAMPLE_SIZE = 1000   #trips sampled per (color, month)
+Z_95 = 1.959964      #two sided 95% normal quantile
+
+
+#stratified estimate of the co2 total of every group (e.g. every hour of day) with its variance:
+#total = sum over strata of N * mean(y), var = sum of N^2 (1 - n/N) s^2 / n, y = co2 inside the group else 0
+def group_totals(sample, strata, key):
+    sizes = strata.set_index("month_start")[["population", "sample_size"]]
+
+    grouped = (sample.assign(co2_sq=sample["co2"] ** 2)
+               .groupby(["month_start", key])[["co2", "co2_sq"]].sum()
+               .rename(columns={"co2": "sum_y", "co2_sq": "sum_y2"})
+               .join(sizes, on="month_start"))
+
+    n, N = grouped["sample_size"], grouped["population"]
+    mean = grouped["sum_y"] / n
+    #sample variance of y over the whole stratum, rows outside the group count as zeros
+    var = ((grouped["sum_y2"] - n * mean ** 2) / (n - 1).clip(lower=1)).clip(lower=0)
+    grouped["total"] = N * mean
+    grouped["var"] = N ** 2 * (1 - n / N) * var / n
+
+    return grouped.groupby(level=key)[["total", "var"]].sum()
+
+
+#averages per group: estimated total / calendar units covered, with a 95% interval
+def group_averages(sample, strata, key, units):
+    totals = group_totals(sample, strata, key)
+    units = units.reindex(totals.index)
+    avg = totals["total"] / units
+    half = Z_95 * np.sqrt(totals["var"]) / units
+    return pd.DataFrame({"avg": avg, "low": avg - half, "high": avg + half}).dropna()
+
+
+#the top group and whether its interval clears the runner-up's (False = ranking not separable)
+def ranked(averages, heaviest: bool):
+    ordered = averages.sort_values("avg", ascending=not heaviest)
+    best = ordered.iloc[0]
+    separable = True
+    if len(ordered) > 1:
+        runner_up = ordered.iloc[1]
+        separable = best["low"] > runner_up["high"] if heaviest else best["high"] < runner_up["low"]
+    return {"key": ordered.index[0], "avg": best["avg"], "low": best["low"], "high": best["high"],
+            "separable": bool(separable)}
+
+
+#calendar units every average is divided by: active (day, hour) cells per hour of day, and
+#the active days counted per weekday, per week of year across years and per month across years
+def calendar_units(days, hour_cells):
+    days = pd.DatetimeIndex(pd.to_datetime(days))
+    iso = days.isocalendar()
+    return {
+        "h": hour_cells,
+        "dow": pd.Series((days.dayofweek + 1) % 7).value_counts(),
+        #calendar year with iso week, the same grouping as the exact answer in analysis.py
+        "week": pd.DataFrame({"year": days.year, "week": iso["week"].values})
+                  .drop_duplicates().groupby("week").size(),
+        "month": pd.DataFrame({"year": days.year, "month": days.month})
+                   .drop_duplicates().groupby("month").size(),
+    }
+
+
+#heaviest/lightest hour, day of week, week and month of one color, each with its interval
+#days: dates with trips, hour_cells: number of (day, hour) cells with trips per hour of day
+def approx_answers(sample, strata, days, hour_cells):
+    sample = sample.copy()
+    sample["co2"] = sample["co2"].fillna(0.0)
+    pickup = pd.to_datetime(sample["pickup_datetime"])
+    sample["h"] = pickup.dt.hour
+    sample["dow"] = (pickup.dt.dayofweek + 1) % 7   #0=Sun..6=Sat
+    sample["week"] = pickup.dt.isocalendar()["week"].astype(int).values
+    sample["month"] = pickup.dt.month
+    units = calendar_units(days, hour_cells)
+
+    answers = {
+        "largest_trip": strata["max_co2"].max(),
+        "sampled_trips": len(sample),
+        "population": int(strata["population"].sum()),
+    }
+    for key, name in (("h", "hour"), ("dow", "dow"), ("week", "week"), ("month", "month")):
+        averages = group_averages(sample, strata, key, units[key])
+        answers[f"heaviest_{name}"] = ranked(averages, heaviest=True)
+        answers[f"lightest_{name}"] = ranked(averages, heaviest=False)
+    return answers
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from pathlib import Path
+from datetime import datetime
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from synthetic import generate_dataset
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+logs_dir = project_root / "logs"
+results_path = logs_dir / "benchmark_results.jsonl"
+
+logs_dir.mkdir(parents=True, exist_ok=True)
+
+logger = logging.getLogger(__name__)
+
+
+#stand-in for the TLC CDN: serves a directory over http on a free local port
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def local_cdn(directory: Path):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(directory)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+#wall time of one stage function, its printed output is hidden unless verbose
+#stages catch their own errors and return False, which must not be stored as a valid timing
+def timed_stage(func, verbose: bool, **kwargs):
+    sink = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    start = time.perf_counter()
+    with sink:
+        ok = func(**kwargs)
+    if not ok:
+        raise RuntimeError(f"{func.__name__} failed, see its log; benchmark result not stored")
+    return time.perf_counter() - start
+
+
+#previous stored run with the same scale and years, for comparison
+def previous_result(scale: float, years):
+    if not results_path.exists():
+        return None
+    previous = None
+    with open(results_path) as f:
+        for line in f:
+            result = json.loads(line)
+            if result["scale"] == scale and result["years"] == list(years):
+                previous = result
+    return previous
+
+
+#generating synthetic data, running load -> clean -> transform -> analysis on it and storing the timings
+def run_benchmark(years, scale: float = 1.0, repeat_load: bool = True, keep: bool = False, verbose: bool = False):
+    work_dir = Path(tempfile.mkdtemp(prefix="taxi_bench_"))
+    source_dir, data_dir = work_dir / "source", work_dir / "data"
+    #every stage opens this database through db.get_connection, the real emissions.duckdb is untouched
+    os.environ["TAXI_DUCKDB_PATH"] = str(work_dir / "bench.duckdb")
+    #charts, cached query results and the parquet lake of the synthetic data stay in work_dir too
+    os.environ["TAXI_OUTPUTS_DIR"] = str(work_dir / "outputs")
+    os.environ["TAXI_RESULT_CACHE_DIR"] = str(work_dir / "result_cache")
+    os.environ["TAXI_LAKE_DIR"] = str(work_dir / "lake")
+
+    #imported after the TAXI_* paths are set; the stages share the first stage's log file in this process
+    from load import load_parquet_files
+    from clean import clean_trip_files
+    from transform import transform_trips
+    from analysis import analyze_files
+    from db import get_connection
+    from profiling import StageReport
+    from maintenance import TRIPS_TABLES, zone_map_report
+
+    try:
+        start = time.perf_counter()
+        generate_dataset(source_dir, years, scale=scale)
+        generate_seconds = time.perf_counter() - start
+
+        #only the generated years are requested from the local cdn
+        scope = {"start_month": f"{min(years)}-01", "end_month": f"{max(years)}-12"}
+        stages = {}
+        with local_cdn(source_dir) as base_url:
+            stages["load"] = timed_stage(load_parquet_files, verbose, base_url=base_url, dest_dir=data_dir, **scope)
+            stages["clean"] = timed_stage(clean_trip_files, verbose)
+            stages["transform"] = timed_stage(transform_trips, verbose)
+            stages["analysis"] = timed_stage(analyze_files, verbose)
+            #second load on unchanged files measures the incremental no-op path
+            if repeat_load:
+                stages["load_noop"] = timed_stage(load_parquet_files, verbose, base_url=base_url, dest_dir=data_dir,
+                                                  **scope)
+                stages["transform_noop"] = timed_stage(transform_trips, verbose)
+
+        #share of each trips table a color / one month filter scans, given the stages' physical ordering
+        con = get_connection(read_only=True)
+        with contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w")):
+            zone_maps = zone_map_report(con, TRIPS_TABLES, StageReport("maintenance_zonemaps"))
+        con.close()
+
+        result = {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "scale": scale,
+            "years": list(years),
+            "generate_seconds": round(generate_seconds, 3),
+            "stages": {name: round(seconds, 3) for name, seconds in stages.items()},
+            "pipeline_seconds": round(sum(stages[name] for name in ("load", "clean", "transform", "analysis")), 3),
+            "zone_maps": zone_maps,
+        }
+    finally:
+        if keep:
+            print(f"Benchmark files kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    previous = previous_result(scale, years)
+    with open(results_path, "a") as f:
+        f.write(json.dumps(result) + "\n")
+    return result, previous
+
+
+#printing this run next to the previous comparable one
+def print_result(result, previous):
+    print(f"\nBenchmark scale={result['scale']} years={result['years'][0]}-{result['years'][-1]}")
+    for name, seconds in list(result["stages"].items()) + [("pipeline", result["pipeline_seconds"])]:
+        line = f"{name:<15} {seconds:>9.3f}s"
+        before = previous["stages"].get(name) if previous and name != "pipeline" else \
+            (previous["pipeline_seconds"] if previous else None)
+        if before:
+            line += f"   (previous {before:.3f}s, {100 * (seconds - before) / before:+.1f}%)"
+        print(line)
+    for table, fractions in result.get("zone_maps", {}).items():
+        if fractions:
+            print(f"{table:<15} color filter scans {fractions['color_scanned']:.1%} (matches {fractions['color_matched']:.1%}), "
+                  f"month filter scans {fractions['month_scanned']:.1%} (matches {fractions['month_matched']:.1%})")
+    print(f"Results appended to {results_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark on synthetic data")
+    parser.add_argument("--years", type=int, nargs="+", default=[2024], help="years of synthetic data to generate")
+    parser.add_argument("--scale", type=float, default=1.0, help="scale factor, 1 = 10,000 trips per monthly file")
+    parser.add_argument("--no-repeat", action="store_true", help="skip the incremental no-op load/transform timing")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files and database")
+    parser.add_argument("--verbose", action="store_true", help="show each stage's printed output")
+    args = parser.parse_args()
+
+    try:
+        result, previous = run_benchmark(args.years, args.scale, not args.no_repeat, args.keep, args.verbose)
+        print_result(result, previous)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+        sys.exit(1)
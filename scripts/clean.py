@@ -1,5 +1,11 @@
-import duckdb
+import sys
 import logging
+import argparse
+
+from db import connection_settings, get_connection
+from dedup import DEFAULT_MEMORY, KEY_COLUMNS, ChunkedDedup
+from profiling import StageReport
+from result_cache import bump_data_version
 
 
 logging.basicConfig(
@@ -13,76 +19,340 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+SOURCE_TABLE = "trips_all"    #loaded trips from scripts/load.py
+CLEAN_TABLE = "trips_clean"   #cleaned trips read by the transform stage
+
+#row-level cleaning rules as bits of a failed_rules mask, a trip is kept only when the mask is 0
+#NULLs count as failures so every rejected row carries at least one bit
+CLEAN_RULES = [
+    (1, "passenger_count", "NOT coalesce(passenger_count > 0, false)"),
+    (2, "distance_zero",   "NOT coalesce(trip_distance > 0, false)"),
+    (4, "distance_over_100", "coalesce(trip_distance > 100, false)"),
+    (8, "duration",        "NOT coalesce(date_diff('second', pickup_datetime, dropoff_datetime) BETWEEN 0 AND 86400, false)"),
+]
+FAILED_RULES_SQL = " + ".join(f"CASE WHEN {check} THEN {bit} ELSE 0 END" for bit, _, check in CLEAN_RULES)
+
+
+#running totals so per-month batch stats can be combined into whole-table averages
+class CleanStats:
+    def __init__(self):
+        self.rows = 0
+        self.dist_sum = 0.0
+        self.dist_count = 0
+        self.dist_max = None
+        self.pass_sum = 0.0
+        self.pass_count = 0
+        self.dur_max = None
+
+    def add(self, rows, dist_sum, dist_count, dist_max, pass_sum, pass_count, dur_max=None):
+        self.rows += rows
+        self.dist_sum += dist_sum or 0
+        self.dist_count += dist_count
+        self.pass_sum += pass_sum or 0
+        self.pass_count += pass_count
+        if dist_max is not None:
+            self.dist_max = dist_max if self.dist_max is None else max(self.dist_max, dist_max)
+        if dur_max is not None:
+            self.dur_max = dur_max if self.dur_max is None else max(self.dur_max, dur_max)
+
+    def avg_distance(self):
+        return self.dist_sum / self.dist_count if self.dist_count else 0.0
+
+    def avg_passengers(self):
+        return self.pass_sum / self.pass_count if self.pass_count else 0.0
+
+
+#one narrow grouped pass over the source: the (color, pickup month) batches plus the PRE cleaning stats
+#color-major order, so cleaning the batches in order writes trips_clean clustered by (color, pickup_datetime)
+def month_batches(con):
+    return con.execute(f"""
+        SELECT
+          color,
+          date_trunc('month', pickup_datetime) AS month_start,
+          COUNT(*), SUM(trip_distance), COUNT(trip_distance), MAX(trip_distance),
+          SUM(passenger_count), COUNT(passenger_count)
+        FROM {SOURCE_TABLE}
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+    """).fetchall()
+
+
+#tables written by the cleaning pass, recreated on every run
+def create_clean_tables(con):
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {CLEAN_TABLE} (
+            color             VARCHAR,
+            passenger_count   TINYINT,
+            trip_distance     FLOAT,
+            pickup_datetime   TIMESTAMP,
+            dropoff_datetime  TIMESTAMP,
+            trip_duration_sec BIGINT
+        );
+    """)
+    #rows that failed at least one rule, failed_rules is the CLEAN_RULES bitmask
+    con.execute("""
+        CREATE OR REPLACE TABLE trips_rejected (
+            color            VARCHAR,
+            passenger_count  TINYINT,
+            trip_distance    FLOAT,
+            pickup_datetime  TIMESTAMP,
+            dropoff_datetime TIMESTAMP,
+            source_file      VARCHAR,
+            failed_rules     UTINYINT
+        );
+    """)
+    rule_columns = ",\n            ".join(f"failed_{name} BIGINT" for _, name, _ in CLEAN_RULES)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE clean_rule_summary (
+            month_start DATE,
+            color       VARCHAR,
+            rows_in     BIGINT,
+            rejected    BIGINT,
+            {rule_columns},
+            duplicates  BIGINT,
+            rows_out    BIGINT,
+            content_hash UBIGINT,
+            passed      BIGINT,
+            violations  BIGINT
+        );
+    """)
+
+
+#cleaning one pickup month in a single read of the source: every row gets its failed_rules mask,
+#passing rows are deduplicated inside the month, failing rows go to quarantine, and the rule counts
+#and POST stats come from the same batch. duplicates share a pickup time so they never cross months
+#dedup: None deduplicates with SELECT DISTINCT, a ChunkedDedup streams the month through its
+#bounded-memory engine instead (rows_in sizes its partitions); both give the same rows
+#color limits the batch to one taxi color (None cleans every color of the month)
+def clean_month(con, month_start, dedup=None, rows_in=0, color=None):
+    month_filter = "pickup_datetime IS NULL" if month_start is None else \
+        "pickup_datetime >= $month AND pickup_datetime < $month + INTERVAL 1 MONTH"
+    params = {} if month_start is None else {"month": month_start}
+    if color is not None:
+        month_filter += " AND color = $color"
+        params["color"] = color
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE month_batch AS
+        SELECT
+            color, passenger_count, trip_distance, pickup_datetime, dropoff_datetime, source_file,
+            ({FAILED_RULES_SQL})::UTINYINT AS failed_rules
+        FROM {SOURCE_TABLE}
+        WHERE {month_filter};
+    """, params)
+
+    if dedup is None:
+        con.execute("""
+            CREATE OR REPLACE TEMP TABLE clean_batch AS
+            SELECT DISTINCT
+                color, passenger_count, trip_distance, pickup_datetime, dropoff_datetime,
+                date_diff('second', pickup_datetime, dropoff_datetime) AS trip_duration_sec
+            FROM month_batch
+            WHERE failed_rules = 0;
+        """)
+    else:
+        dedup_month(con, dedup, rows_in)
+    con.execute("""
+        INSERT INTO trips_rejected
+        SELECT color, passenger_count, trip_distance, pickup_datetime, dropoff_datetime, source_file, failed_rules
+        FROM month_batch
+        WHERE failed_rules <> 0;
+    """)
+
+    #per-color rule counts, a row failing several rules counts once under each of them
+    rule_counts = ",\n              ".join(
+        f"COUNT(*) FILTER (WHERE failed_rules & {bit} <> 0) AS failed_{name}" for bit, name, _ in CLEAN_RULES)
+    rule_names = ", ".join(f"failed_{name}" for _, name, _ in CLEAN_RULES)
+    #passed and rejected are counted on the input, violations re-applies every rule to the output,
+    #so verify_clean can check the cleaned rows instead of an identity
+    con.execute(f"""
+        INSERT INTO clean_rule_summary
+        WITH counts_in AS (
+            SELECT
+              color, COUNT(*) AS rows_in,
+              COUNT(*) FILTER (WHERE failed_rules <> 0) AS rejected,
+              {rule_counts},
+              COUNT(*) FILTER (WHERE failed_rules = 0) AS passed
+            FROM month_batch
+            GROUP BY color
+        ),
+        counts_out AS (
+            --order independent fingerprint of the cleaned rows, lets the transform skip unchanged months
+            SELECT
+              color, COUNT(*) AS rows_out,
+              bit_xor(hash(passenger_count, trip_distance, pickup_datetime, dropoff_datetime)) AS content_hash,
+              COUNT(*) FILTER (WHERE ({FAILED_RULES_SQL}) <> 0) AS violations
+            FROM clean_batch
+            GROUP BY color
+        )
+        SELECT
+          ?::DATE, color, rows_in, rejected, {rule_names},
+          passed - coalesce(rows_out, 0) AS duplicates,
+          coalesce(rows_out, 0),
+          content_hash,
+          passed,
+          coalesce(violations, 0)
+        FROM counts_in LEFT JOIN counts_out USING (color);
+    """, [month_start])
+
+    stats = con.execute("""
+        SELECT
+          COUNT(*), SUM(trip_distance), COUNT(trip_distance), MAX(trip_distance),
+          SUM(passenger_count), COUNT(passenger_count), MAX(trip_duration_sec)
+        FROM clean_batch
+    """).fetchone()
+    #batches come color-major and each is sorted by pickup, so trips_clean ends up ordered by (color, pickup_datetime)
+    con.execute(f"INSERT INTO {CLEAN_TABLE} SELECT * FROM clean_batch ORDER BY color, pickup_datetime;")
+    con.execute("DROP TABLE clean_batch;")
+    con.execute("DROP TABLE month_batch;")
+    return stats
+
+
+#filling clean_batch from month_batch with the chunked engine, one deduplicated partition at a time
+def dedup_month(con, dedup: ChunkedDedup, rows_in: int):
+    keys = ", ".join(KEY_COLUMNS)
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE clean_batch AS
+        SELECT {keys}, date_diff('second', pickup_datetime, dropoff_datetime) AS trip_duration_sec
+        FROM month_batch
+        LIMIT 0;
+    """)
+    source = f"SELECT {keys} FROM month_batch WHERE failed_rules = 0"
+    for part in dedup.distinct(con, source, rows_hint=rows_in):
+        con.register("dedup_part", part)
+        con.execute(f"""
+            INSERT INTO clean_batch
+            SELECT {keys}, date_diff('second', pickup_datetime, dropoff_datetime)
+            FROM dedup_part;
+        """)
+        con.unregister("dedup_part")
+
+
+#checking the cleaning from counts recorded independently in the same pass, instead of re-scanning
+#the cleaned table: no kept row may break a rule, every input row must have passed or been rejected,
+#dedup can only remove passing rows, and the summary must match the rows actually written
+def verify_clean(con):
+    rule_sums = ", ".join(f"SUM(failed_{name})" for _, name, _ in CLEAN_RULES)
+    totals = con.execute(f"""
+        SELECT SUM(rows_in), SUM(rejected), SUM(passed), SUM(duplicates), SUM(rows_out), SUM(violations), {rule_sums}
+        FROM clean_rule_summary
+    """).fetchone()
+    rows_in, rejected, passed, duplicates, rows_out, violations = (v or 0 for v in totals[:6])
+    clean_rows = con.execute(f"SELECT COUNT(*) FROM {CLEAN_TABLE}").fetchone()[0]
+    rejected_rows = con.execute("SELECT COUNT(*) FROM trips_rejected").fetchone()[0]
+
+    print("\nCLEANING RULE CHECKS (clean_rule_summary)")
+    print(f"Duplicate trips removed:            {duplicates:,}")
+    for (_, name, _), count in zip(CLEAN_RULES, totals[6:]):
+        print(f"Trips removed by {name + ':':<20}{(count or 0):,}")
+        logger.info("Rule %s removed %s rows", name, count or 0)
+
+    checks = {
+        "no kept row breaks a rule": violations == 0,
+        "rejected + passed = rows in": rejected + passed == rows_in,
+        "rows out <= passed": rows_out <= passed,
+        f"rows out = rows in {CLEAN_TABLE}": rows_out == clean_rows,
+        "rejected = rows in trips_rejected": rejected == rejected_rows,
+    }
+    for name, ok in checks.items():
+        print(f"{name + ':':<40}{ok}")
+    logger.info("Clean verification: rows_in=%s, rejected=%s, passed=%s, duplicates=%s, rows_out=%s, violations=%s, checks=%s",
+                rows_in, rejected, passed, duplicates, rows_out, violations, checks)
+    failed = [name for name, ok in checks.items() if not ok]
+    if failed:
+        raise ValueError(f"clean verification failed: {', '.join(failed)}")
+    return True
+
+
 #creating function that cleans the combined table of yellow and green taxi data
-def clean_trip_files():
+#engine="chunked" deduplicates through ChunkedDedup within dedup_memory instead of SELECT DISTINCT
+def clean_trip_files(profile: bool = False, engine: str = "sql", dedup_memory: str = DEFAULT_MEMORY):
 
     con = None
+    report = StageReport("clean", profile)
 
     try:
         # Connect to local DuckDB instance
-        con = duckdb.connect(database='emissions.duckdb', read_only=False)
-        logger.info("Connected to DuckDB instance for CLEANING")
+        con = get_connection()
+        logger.info("Connected to DuckDB instance for CLEANING (dedup engine=%s)", engine)
 
-        #getting statistics to check PRE cleaning
-        pre = con.execute("""
-            SELECT
-              COUNT(*)                            AS total_rows,
-              AVG(trip_distance)                  AS avg_distance,
-              MAX(trip_distance)                  AS max_distance,
-              AVG(passenger_count)                AS avg_passengers
-            FROM trips_2024
-        """).fetchone()
-
-        #table UPDATE
-        con.execute(f"""
-        CREATE OR REPLACE TABLE trips_2024 AS
-        SELECT DISTINCT *,
-            date_diff('second', pickup_datetime, dropoff_datetime) AS trip_duration_sec
-        FROM trips_2024
-        WHERE passenger_count > 0 
-            AND trip_distance > 0 
-            AND trip_distance <= 100 
-            AND date_diff('second', pickup_datetime, dropoff_datetime) BETWEEN 0 AND 86400;
-    """)
+        #spill files of the chunked engine go next to duckdb's own
+        dedup = None
+        if engine == "chunked":
+            dedup = ChunkedDedup(dedup_memory, connection_settings()["temp_directory"] or None)
 
-        #getting statistics to check POST cleaning
-        post = con.execute("""
-        SELECT
-            COUNT(*)                            AS total_rows,
-            AVG(trip_distance)                  AS avg_distance,
-            MAX(trip_distance)                  AS max_distance,
-            AVG(passenger_count)                AS avg_passengers,
-            MAX(trip_duration_sec)              AS max_duration_sec
-        FROM trips_2024
-    """).fetchone()
+        #getting statistics to check PRE cleaning, grouped by color and month so each pair is one batch
+        with report.query(con, "month batches + pre stats"):
+            batches = month_batches(con)
+        pre, post = CleanStats(), CleanStats()
+        for color, month_start, *month_pre in batches:
+            pre.add(*month_pre)
+
+        #one transaction so a failure part way through leaves the previous clean table intact
+        con.execute("BEGIN TRANSACTION;")
+        create_clean_tables(con)
+
+        #month-sized batches keep the dedup hash table to one month instead of the whole decade
+        #(rows without a pickup time form their own batch per color and all land in quarantine)
+        #every color's months are written before the next color's, so trips_clean is color-major
+        #and both color and time filters prune row groups without a later recluster
+        for color, month_start, rows_in, *_ in batches:
+            with report.step(f"clean {color} {month_start}") as record:
+                month_post = clean_month(con, month_start, dedup, rows_in, color)
+                record["rows_in"], record["rows_out"] = rows_in, month_post[0]
+            post.add(*month_post)
+            logger.debug("Cleaned %s month %s", color, month_start)
+        #checked before committing, so a failed check leaves the previous clean tables in place
+        verify_clean(con)
+        bump_data_version(con, "clean")
+        con.execute("COMMIT;")
 
         #printing stats PRE cleaning
-        print("\nBEFORE CLEANING (trips_2024)")
-        print(f"Total rows:         {pre[0]:,}")
-        print(f"Avg distance (mi):  {pre[1]:.2f}")
-        print(f"Max distance (mi):  {pre[2]:.2f}")
-        print(f"Avg passengers:     {pre[3]:.2f}")
-        
+        print(f"\nBEFORE CLEANING ({SOURCE_TABLE})")
+        print(f"Total rows:         {pre.rows:,}")
+        print(f"Avg distance (mi):  {pre.avg_distance():.2f}")
+        print(f"Max distance (mi):  {(pre.dist_max or 0):.2f}")
+        print(f"Avg passengers:     {pre.avg_passengers():.2f}")
+
 
         #printing stats POST cleaning
-        print("\nAFTER CLEANING (trips_2024)")
-        print(f"Total rows:         {post[0]:,}")
-        print(f"Avg distance (mi):  {post[1]:.2f}")
-        print(f"Max distance (mi):  {post[2]:.2f}")
-        print(f"Avg passengers:     {post[3]:.2f}")
-        print(f"Max duration (sec): {int(post[4]) if post[4] is not None else None}")
+        print(f"\nAFTER CLEANING ({CLEAN_TABLE})")
+        print(f"Total rows:         {post.rows:,}")
+        print(f"Avg distance (mi):  {post.avg_distance():.2f}")
+        print(f"Max distance (mi):  {(post.dist_max or 0):.2f}")
+        print(f"Avg passengers:     {post.avg_passengers():.2f}")
+        print(f"Max duration (sec): {int(post.dur_max) if post.dur_max is not None else None}")
 
         #logging to file
         logger.info("BEFORE CLEANING: total_rows=%s, avg_dist=%.2f, max_dist=%.2f, avg_pass=%.2f",
-                    pre[0], pre[1], pre[2], pre[3])
+                    pre.rows, pre.avg_distance(), pre.dist_max or 0, pre.avg_passengers())
         logger.info("AFTER CLEANING: total_rows=%s, avg_dist=%.2f, max_dist=%.2f, avg_pass=%.2f, max_dur=%s",
-                    post[0], post[1], post[2], post[3], post[4])
+                    post.rows, post.avg_distance(), post.dist_max or 0, post.avg_passengers(), post.dur_max)
+
+        if dedup is not None:
+            report.set_total("dedup_partitions_spilled", dedup.partitions_spilled)
+            report.set_total("dedup_bytes_spilled", dedup.bytes_spilled)
+            logger.info("Chunked dedup: %s partitions spilled, %s bytes, %s rows per chunk",
+                        dedup.partitions_spilled, dedup.bytes_spilled, dedup.chunk_rows)
+        report.set_total("rows_in", pre.rows)
+        report.set_total("rows_out", post.rows)
 
         con.close()
+        return True
 
     except Exception as e:
         print(f"An error occurred: {e}")
         logger.error(f"An error occurred: {e}")
+        return False
+
+    finally:
+        logger.info("Run report written to %s", report.write())
 
 if __name__ == "__main__":
-    clean_trip_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Clean trips_all into trips_clean")
+    parser.add_argument("--profile", action="store_true", help="include duckdb query profiles in the run report")
+    parser.add_argument("--dedup", choices=["sql", "chunked"], default="sql",
+                        help="sql: SELECT DISTINCT per month; chunked: fingerprint and spill partitions within --dedup-memory")
+    parser.add_argument("--dedup-memory", default=DEFAULT_MEMORY, help="memory budget of the chunked dedup, e.g. 256MB")
+    args = parser.parse_args()
+    ok = clean_trip_files(profile=args.profile, engine=args.dedup, dedup_memory=args.dedup_memory)
+    sys.exit(0 if ok else 1)
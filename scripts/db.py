@@ -0,0 +1,64 @@
+import os
+import duckdb
+import configparser
+from pathlib import Path
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+config_path = project_root / "pipeline.ini"
+
+#duckdb settings every stage connects with. values come from (lowest to highest priority):
+#these defaults, the [duckdb] section of pipeline.ini, TAXI_DUCKDB_* environment variables,
+#and keyword overrides passed to get_connection
+DEFAULT_SETTINGS = {
+    "database": str(project_root / "emissions.duckdb"),
+    "threads": str(os.cpu_count() or 1),
+    "memory_limit": "",           #empty keeps duckdb's default (80% of RAM)
+    "temp_directory": str(project_root / "data" / "duckdb_tmp"),
+    "max_temp_directory_size": "",
+    "preserve_insertion_order": "",
+}
+
+ENV_PREFIX = "TAXI_DUCKDB_"  #e.g. TAXI_DUCKDB_THREADS=32, TAXI_DUCKDB_MEMORY_LIMIT=64GB, TAXI_DUCKDB_PATH=...
+
+
+#resolving the settings for one connection
+def connection_settings(**overrides):
+    settings = dict(DEFAULT_SETTINGS)
+
+    if config_path.exists():
+        parser = configparser.ConfigParser()
+        parser.read(config_path)
+        if parser.has_section("duckdb"):
+            settings.update({key: value for key, value in parser.items("duckdb") if key in settings})
+
+    for key in settings:
+        env_key = ENV_PREFIX + ("PATH" if key == "database" else key.upper())
+        if os.environ.get(env_key):
+            settings[key] = os.environ[env_key]
+
+    settings.update({key: str(value) for key, value in overrides.items() if value is not None})
+
+    #relative database/temp paths are relative to the project, not the working directory
+    for key in ("database", "temp_directory"):
+        if settings[key] and settings[key] != ":memory:" and not Path(settings[key]).is_absolute():
+            settings[key] = str(project_root / settings[key])
+    return settings
+
+
+#opening the pipeline database with the resolved settings
+#read_only connections can be opened by several analysis processes at once
+def get_connection(read_only: bool = False, **overrides):
+    settings = connection_settings(**overrides)
+    database = settings.pop("database")
+
+    config = {key: value for key, value in settings.items() if value != ""}
+    if "threads" in config:
+        config["threads"] = int(config["threads"])
+    if "preserve_insertion_order" in config:
+        config["preserve_insertion_order"] = config["preserve_insertion_order"].lower() in ("1", "true", "yes")
+    if "temp_directory" in config:
+        Path(config["temp_directory"]).mkdir(parents=True, exist_ok=True)
+
+    return duckdb.connect(database=database, read_only=read_only, config=config)
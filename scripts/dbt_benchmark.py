@@ -0,0 +1,59 @@
+import time
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+logs_dir = project_root / "logs"
+dbt_dir = project_root / "dbt"
+
+logs_dir.mkdir(parents=True, exist_ok=True)
+
+logging.basicConfig(
+    filename = str(logs_dir/"transform.log"),
+    encoding = "utf-8",
+    filemode = "a",
+    format = "{asctime} - {levelname} - {message}",
+    style = "{",
+    datefmt = "%Y-%m-%d %H:%M",
+    level = "DEBUG"
+)
+logger = logging.getLogger(__name__)
+
+
+#running one dbt command inside dbt/ and returning its wall time in seconds
+def timed_dbt(args):
+    command = ["dbt", *args, "--project-dir", str(dbt_dir), "--profiles-dir", str(dbt_dir)]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=dbt_dir, check=True)
+    return time.perf_counter() - start
+
+
+#comparing a full-refresh build of every model with an incremental run on the same data
+def benchmark_dbt(runs: int = 1):
+
+    try:
+        full_times, incremental_times = [], []
+        for _ in range(runs):
+            full_times.append(timed_dbt(["run", "--full-refresh"]))
+            #nothing new was loaded in between, so this is the no-new-months cost
+            incremental_times.append(timed_dbt(["run"]))
+
+        full, incremental = min(full_times), min(incremental_times)
+        print(f"dbt run --full-refresh: {full:.2f}s")
+        print(f"dbt run (incremental):  {incremental:.2f}s")
+        print(f"Speedup: {full / incremental:.1f}x" if incremental else "Speedup: n/a")
+        logger.info("dbt benchmark: full_refresh=%.2fs, incremental=%.2fs, runs=%s", full, incremental, runs)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time dbt full-refresh against an incremental run")
+    parser.add_argument("--runs", type=int, default=1, help="repetitions, the fastest of each is reported")
+    args = parser.parse_args()
+    benchmark_dbt(runs=args.runs)
@@ -0,0 +1,159 @@
+import math
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+#out-of-core alternative to the SELECT DISTINCT in scripts/clean.py, for hosts where a month's
+#dedup hash table does not fit in memory. rows are streamed from duckdb in arrow chunks and every
+#row gets a 64-bit fingerprint of its key columns. the fingerprint's top bits pick one of a power of
+#two number of partitions spilled to arrow files on disk, sized so one partition fits the memory
+#budget; identical rows always land in the same partition. inside a partition rows with a unique
+#fingerprint are kept as they are, rows sharing one are compared column by column (arrow group_by),
+#so a fingerprint collision never drops a distinct trip and the result equals SELECT DISTINCT
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ["color", "passenger_count", "trip_distance", "pickup_datetime", "dropoff_datetime"]
+FINGERPRINT = "_fingerprint"
+
+DEFAULT_MEMORY = "256MB"   #python-side working set of the dedup; duckdb's own memory_limit still applies
+ROW_BYTES = 48             #arrow bytes per row: the key columns plus the fingerprint
+WORK_FACTOR = 4            #peak memory per partition byte: table, candidate copy, group_by hash table
+MAX_CHUNK_ROWS = 1_000_000
+MAX_PARTITIONS = 256       #spill files open at once
+
+SEED = np.uint64(0x9E3779B97F4A7C15)
+UNITS = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4,
+         "KIB": 1024, "MIB": 1024 ** 2, "GIB": 1024 ** 3, "TIB": 1024 ** 4}
+
+
+#"256MB" / "2GiB" / "1000000" -> bytes
+def parse_bytes(size: str):
+    size = str(size).strip().upper()
+    number = "".join(ch for ch in size if ch.isdigit() or ch == ".")
+    unit = size[len(number):].strip() or "B"
+    if not number or unit not in UNITS:
+        raise ValueError(f"invalid memory size {size!r}, expected e.g. 256MB or 2GiB")
+    return int(float(number) * UNITS[unit])
+
+
+#splitmix64 finalizer, spreads every input bit over the whole 64-bit output
+def mix64(x):
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+#one uint64 per row for a column; equal values always give equal bits (nulls count as 0)
+def column_bits(column):
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        #strings are hashed once per distinct value, then spread over the rows by dictionary index
+        encoded = column.dictionary_encode()
+        if not len(encoded.dictionary):
+            return np.zeros(len(column), dtype=np.uint64)
+        words = [int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "little")
+                 for value in encoded.dictionary.to_pylist()]
+        return np.asarray(words, dtype=np.uint64)[encoded.indices.fill_null(0).to_numpy()]
+    if pa.types.is_floating(column.type):
+        values = column.fill_null(0).to_numpy().astype(np.float64)
+        #-0.0 and 0.0, and every NaN, compare equal, so they must share their bits too
+        values = np.where(np.isnan(values), np.nan, values + 0.0)
+        return values.view(np.uint64)
+    if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+        column = column.cast(pa.int64())
+    return column.fill_null(0).cast(pa.int64()).to_numpy().view(np.uint64)
+
+
+#64-bit fingerprint of every row over the key columns
+def fingerprints(table: pa.Table, columns=KEY_COLUMNS):
+    h = np.full(table.num_rows, SEED, dtype=np.uint64)
+    for name in columns:
+        h = mix64(h ^ column_bits(table.column(name)))
+    return h
+
+
+#exact distinct rows of one partition; only rows whose fingerprint repeats are compared in full
+def distinct_rows(table: pa.Table, fp, columns=KEY_COLUMNS):
+    if not table.num_rows:
+        return table
+    _, inverse, counts = np.unique(fp, return_inverse=True, return_counts=True)
+    repeated = counts[inverse] > 1
+    if not repeated.any():
+        return table
+    singles = table.filter(pa.array(~repeated))
+    candidates = (table.filter(pa.array(repeated))
+                  .group_by(columns, use_threads=False).aggregate([])
+                  .select(columns).cast(table.schema))
+    return pa.concat_tables([singles, candidates])
+
+
+class ChunkedDedup:
+    def __init__(self, memory_budget: str = DEFAULT_MEMORY, temp_dir: Path = None):
+        self.memory_bytes = parse_bytes(memory_budget)
+        self.temp_dir = Path(temp_dir) if temp_dir else None
+        self.chunk_rows = max(10_000, min(MAX_CHUNK_ROWS, self.memory_bytes // (ROW_BYTES * WORK_FACTOR)))
+        self.partitions_spilled = 0
+        self.bytes_spilled = 0
+
+    #partitions needed for rows_hint rows, a power of two so the fingerprint's top bits pick one
+    def partition_count(self, rows_hint: int):
+        needed = math.ceil((rows_hint or 0) * ROW_BYTES * WORK_FACTOR / self.memory_bytes)
+        count = 1 << max(0, math.ceil(math.log2(max(needed, 1))))
+        #fewer partitions would hold more than the budget each, so the ceiling could not be kept
+        if count > MAX_PARTITIONS:
+            raise ValueError(f"{rows_hint:,} rows need {count} partitions within a {self.memory_bytes:,} byte "
+                             f"budget, more than the {MAX_PARTITIONS} allowed; raise the dedup memory budget")
+        return count
+
+    #distinct rows of sql (selecting the key columns) as a stream of arrow tables, one per partition
+    #the query result is read completely before the first table is yielded, so the caller can use con again
+    def distinct(self, con, sql: str, params=None, rows_hint: int = 0):
+        reader = con.execute(sql, params or []).to_arrow_reader(self.chunk_rows)
+        partitions = self.partition_count(rows_hint)
+
+        if partitions == 1:
+            table = reader.read_all()
+            yield distinct_rows(table, fingerprints(table))
+            return
+
+        shift = np.uint64(64 - int(math.log2(partitions)))
+        with tempfile.TemporaryDirectory(prefix="dedup_", dir=self.temp_dir) as spill_dir:
+            paths = [Path(spill_dir) / f"part_{i}.arrow" for i in range(partitions)]
+            schema = reader.schema.append(pa.field(FINGERPRINT, pa.uint64()))
+            sinks = [pa.OSFile(str(path), "wb") for path in paths]
+            writers = [pa.ipc.new_stream(sink, schema) for sink in sinks]
+            try:
+                #pass 1: fingerprint each chunk and append its rows to their partition files
+                for batch in reader:
+                    chunk = pa.Table.from_batches([batch])
+                    fp = fingerprints(chunk)
+                    part = (fp >> shift).astype(np.intp)
+                    order = np.argsort(part, kind="stable")
+                    chunk = chunk.append_column(FINGERPRINT, pa.array(fp)).take(pa.array(order))
+                    offset = 0
+                    for i, rows in enumerate(np.bincount(part, minlength=partitions)):
+                        if rows:
+                            writers[i].write_table(chunk.slice(offset, rows))
+                        offset += rows
+            finally:
+                for writer, sink in zip(writers, sinks):
+                    writer.close()
+                    sink.close()
+
+            self.partitions_spilled += partitions
+            self.bytes_spilled += sum(path.stat().st_size for path in paths)
+
+            #pass 2: one partition in memory at a time
+            for path in paths:
+                with pa.OSFile(str(path), "rb") as source:
+                    table = pa.ipc.open_stream(source).read_all()
+                fp = table.column(FINGERPRINT).to_numpy()
+                yield distinct_rows(table.drop_columns([FINGERPRINT]), fp)
+                path.unlink()
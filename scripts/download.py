@@ -0,0 +1,183 @@
+import os
+import json
+import logging
+import argparse
+import urllib.error
+import urllib.request
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+logs_dir = project_root / "logs"
+data_dir   = project_root / "data"
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024  #1MB per read while streaming a file to disk
+PARQUET_MAGIC = b"PAR1"   #every parquet file starts and ends with these bytes
+
+
+#remote version of a file from a HEAD request: size, ETag and Last-Modified (None when not sent)
+def remote_info(url: str, timeout: int = 30):
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        size = response.headers.get("Content-Length")
+        return {"size": int(size) if size is not None else None,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")}
+
+
+#sidecar next to a cached file recording the remote version it was downloaded from
+def meta_path(path: Path):
+    return Path(path).with_name(Path(path).name + ".json")
+
+
+def read_meta(path: Path):
+    try:
+        with open(meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(path: Path, info: dict):
+    with open(meta_path(path), "w") as f:
+        json.dump(info, f)
+
+
+#true when a cached copy was downloaded from the remote version described by info
+#TLC republishes corrected months, sometimes at the same byte size, so ETag/Last-Modified decide
+def same_version(cached: dict, info: dict):
+    return all(cached.get(key) == info[key] for key in ("etag", "last_modified") if info[key] is not None)
+
+
+#cheap integrity check: expected size (when known) plus parquet header/footer magic bytes
+def verify_file(path: Path, expected_size=None):
+    size = path.stat().st_size
+    if expected_size is not None and size != expected_size:
+        return False
+    if size < 2 * len(PARQUET_MAGIC):
+        return False
+    with open(path, "rb") as f:
+        head = f.read(len(PARQUET_MAGIC))
+        f.seek(-len(PARQUET_MAGIC), os.SEEK_END)
+        tail = f.read(len(PARQUET_MAGIC))
+    return head == PARQUET_MAGIC and tail == PARQUET_MAGIC
+
+
+#downloading one file into dest_dir, resuming a partial .part file with a Range request
+def download_file(url: str, dest_dir: Path = data_dir, timeout: int = 60):
+    dest = Path(dest_dir) / os.path.basename(url)
+    part = dest.with_name(dest.name + ".part")
+
+    try:
+        info = remote_info(url, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        #month not published (404 etc.), nothing to fetch
+        logger.warning("HEAD %s returned %s, skipped", url, e.code)
+        return None
+    except Exception as e:
+        #offline: fall back to a cached copy if we already have one
+        if dest.exists() and verify_file(dest):
+            logger.warning("Could not reach %s (%s), using cached %s", url, e, dest.name)
+            return dest
+        raise
+
+    expected_size = info["size"]
+
+    #already in the cache, matches the remote size and was downloaded from the same remote version
+    if dest.exists() and verify_file(dest, expected_size):
+        cached = read_meta(dest)
+        if cached is None:
+            #cached before versions were recorded: adopt the current remote version
+            write_meta(dest, info)
+            logger.debug("Cached %s, recorded its remote version", dest.name)
+            return dest
+        if same_version(cached, info):
+            logger.debug("Cached %s", dest.name)
+            return dest
+        logger.info("%s changed upstream (%s -> %s), downloading again", dest.name, cached, info)
+
+    offset = part.stat().st_size if part.exists() else 0
+    if expected_size is not None and offset > expected_size:
+        offset = 0
+    #a partial file of an older remote version cannot be continued with the new one's bytes
+    part_version = read_meta(part)
+    if offset and (part_version is None or not same_version(part_version, info)):
+        logger.info("Partial %s is from another remote version, restarting download", dest.name)
+        offset = 0
+    if not offset:
+        write_meta(part, info)
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header("Range", f"bytes={offset}-")
+        #If-Range makes the server send the whole file when it changed since the HEAD request
+        validator = info["etag"] or info["last_modified"]
+        if validator:
+            request.add_header("If-Range", validator)
+
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        #206 means the server honoured the range, anything else sends the whole file again
+        mode = "ab" if offset and response.status == 206 else "wb"
+        if mode == "wb" and offset:
+            logger.info("Server ignored range request for %s, restarting download", dest.name)
+        with open(part, mode) as f:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+
+    if not verify_file(part, expected_size):
+        part.unlink(missing_ok=True)
+        meta_path(part).unlink(missing_ok=True)
+        raise ValueError(f"downloaded {dest.name} failed size/parquet verification")
+
+    os.replace(part, dest)
+    write_meta(dest, info)
+    meta_path(part).unlink(missing_ok=True)
+    logger.info("Downloaded %s (%s bytes)", dest.name, dest.stat().st_size)
+    return dest
+
+
+#fetching many files concurrently, returns {url: local path or None if unavailable}
+def download_files(urls, dest_dir: Path = data_dir, workers: int = 8):
+    Path(dest_dir).mkdir(parents=True, exist_ok=True)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download_file, url, dest_dir): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                #one bad month should not take the others down with it
+                logger.error("Failed downloading %s: %s", url, e)
+                results[url] = None
+    return results
+
+
+if __name__ == "__main__":
+    from load import COLORS, build_urls
+
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename = str(logs_dir/"load.log"),
+        encoding = "utf-8",
+        filemode = "a",
+        format = "{asctime} - {levelname} - {message}",
+        style = "{",
+        datefmt = "%Y-%m-%d %H:%M",
+        level = "DEBUG"
+    )
+
+    parser = argparse.ArgumentParser(description="Download NYC taxi parquet files into data/")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent downloads")
+    args = parser.parse_args()
+
+    urls = [url for color in COLORS for url in build_urls(color)]
+    results = download_files(urls, data_dir, workers=args.workers)
+    ok = sum(1 for path in results.values() if path is not None)
+    print(f"Downloaded/cached {ok} of {len(urls)} files into {data_dir}")
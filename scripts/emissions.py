@@ -0,0 +1,135 @@
+import os
+from pathlib import Path
+
+#versioned emissions dimension: one co2 factor per taxi color and validity range
+#built by scripts/load.py. every color starts from its factor in emissions_lookup
+#(data/vehicle_emissions.csv), valid for all dates. an optional data/emissions_factors.csv
+#(vehicle_type, valid_from, valid_to, co2_grams_per_mile) overrides it for date ranges only,
+#e.g. a fleet change over 2015-2024; the lookup factor still covers every date outside them.
+#valid_to is exclusive and an empty bound is open
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+factors_csv = project_root / "data" / "emissions_factors.csv"
+
+DIM_TABLE = "emissions_dim"
+
+
+#(re)building emissions_dim: each color's emissions_lookup factor, with the date-ranged overrides
+#of the factors csv (when it exists) cut out of its open range
+def load_emissions_dim(con, csv_path: Path = factors_csv):
+    defaults = con.execute("""
+        SELECT vehicle_type, co2_grams_per_mile::DOUBLE
+        FROM emissions_lookup
+        WHERE vehicle_type IN ('yellow_taxi', 'green_taxi')
+    """).fetchall()
+    overrides = []
+    if os.path.exists(csv_path):
+        overrides = con.execute("""
+            SELECT vehicle_type, valid_from, valid_to, co2_grams_per_mile
+            FROM read_csv(?, header = true, columns = {
+                'vehicle_type': 'VARCHAR', 'valid_from': 'DATE', 'valid_to': 'DATE', 'co2_grams_per_mile': 'DOUBLE'
+            })
+            WHERE vehicle_type IN ('yellow_taxi', 'green_taxi')
+            ORDER BY vehicle_type, valid_from NULLS FIRST
+        """, [Path(csv_path).as_posix()]).fetchall()
+
+    rows = list(overrides)
+    for vehicle_type, factor in defaults:
+        #the lookup factor fills every gap before, between and after the color's overrides
+        start = None
+        for _, valid_from, valid_to, _ in (row for row in overrides if row[0] == vehicle_type):
+            if valid_from is not None and (start is None or start < valid_from):
+                rows.append((vehicle_type, start, valid_from, factor))
+            start = valid_to
+            if start is None:
+                break
+        else:
+            rows.append((vehicle_type, start, None, factor))
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {DIM_TABLE} (
+          vehicle_type VARCHAR, color VARCHAR, valid_from DATE, valid_to DATE, co2_grams_per_mile DOUBLE
+        );
+    """)
+    if rows:
+        con.executemany(f"INSERT INTO {DIM_TABLE} VALUES (?, replace(?, '_taxi', ''), ?, ?, ?)",
+                        [(vehicle_type, vehicle_type, valid_from, valid_to, factor)
+                         for vehicle_type, valid_from, valid_to, factor in rows])
+    check_ranges(con)
+    return con.execute(f"SELECT COUNT(*) FROM {DIM_TABLE}").fetchone()[0]
+
+
+#every trip must resolve to at most one factor, so ranges of one color may not overlap
+def check_ranges(con):
+    overlaps = con.execute(f"""
+        SELECT a.color, a.valid_from, a.valid_to, b.valid_from, b.valid_to
+        FROM {DIM_TABLE} a
+        JOIN {DIM_TABLE} b
+          ON a.color = b.color
+         AND a.rowid < b.rowid
+         AND coalesce(a.valid_from, DATE '0001-01-01') < coalesce(b.valid_to, DATE '9999-12-31')
+         AND coalesce(b.valid_from, DATE '0001-01-01') < coalesce(a.valid_to, DATE '9999-12-31')
+    """).fetchall()
+    if overlaps:
+        raise ValueError(f"overlapping emissions factor ranges: {overlaps}")
+
+
+#factor version of every (month, color) of clean_rule_summary: the ranges overlapping the month,
+#clipped to it, so editing a factor only changes the version of the months that factor covers
+MONTH_FACTORS_SQL = f"""
+    SELECT
+      s.month_start,
+      s.color,
+      string_agg(
+        greatest(coalesce(e.valid_from, s.month_start), s.month_start) || '=' || e.co2_grams_per_mile,
+        ',' ORDER BY e.valid_from NULLS FIRST
+      ) AS factor_version
+    FROM clean_rule_summary s
+    JOIN {DIM_TABLE} e
+      ON e.color = s.color
+     AND (e.valid_from IS NULL OR e.valid_from < s.month_start + INTERVAL 1 MONTH)
+     AND (e.valid_to IS NULL OR e.valid_to > s.month_start)
+    WHERE s.month_start IS NOT NULL
+    GROUP BY ALL
+"""
+
+
+#(valid_from, valid_to, factor) ranges of one color that overlap one month
+def month_factors(con, color: str, month_start):
+    return con.execute(f"""
+        SELECT valid_from, valid_to, co2_grams_per_mile
+        FROM {DIM_TABLE}
+        WHERE color = $color
+          AND (valid_from IS NULL OR valid_from < $month + INTERVAL 1 MONTH)
+          AND (valid_to IS NULL OR valid_to > $month)
+        ORDER BY valid_from NULLS FIRST
+    """, {"color": color, "month": month_start}).fetchall()
+
+
+#sql expression giving each trip its grams per mile, plus its named parameters
+#a factor covering the whole month is a single constant broadcast over the scan; otherwise a CASE
+#over the month's few ranges, trips outside every range get NULL. no join with the dimension either way
+def factor_expression(factors, month_start, pickup: str = "t.pickup_datetime"):
+    if not factors:
+        return "NULL::DOUBLE", {}
+    if len(factors) == 1:
+        valid_from, valid_to, factor = factors[0]
+        month_end = month_start.replace(year=month_start.year + month_start.month // 12,
+                                        month=month_start.month % 12 + 1)
+        if (valid_from is None or valid_from <= month_start) and (valid_to is None or valid_to >= month_end):
+            return "$factor_0", {"factor_0": factor}
+
+    branches, params = [], {}
+    for i, (valid_from, valid_to, factor) in enumerate(factors):
+        conditions = []
+        if valid_from is not None:
+            conditions.append(f"{pickup} >= $from_{i}")
+            params[f"from_{i}"] = valid_from
+        if valid_to is not None:
+            conditions.append(f"{pickup} < $to_{i}")
+            params[f"to_{i}"] = valid_to
+        branches.append(f"WHEN {' AND '.join(conditions) or 'true'} THEN $factor_{i}")
+        params[f"factor_{i}"] = factor
+    return f"CASE {' '.join(branches)} END", params
@@ -0,0 +1,42 @@
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+#outcome of one task: its value (or the exception it raised) and how long it took
+@dataclass
+class TaskResult:
+    name: str
+    value: Any = None
+    seconds: float = 0.0
+    error: Optional[Exception] = None
+
+
+#running independent tasks concurrently, each on its own cursor of the same connection
+#a task is a function taking a cursor; with a read_only connection every cursor is read-only too
+def run_parallel(con, tasks: dict, workers: Optional[int] = None):
+
+    def run(name, task):
+        cursor = con.cursor()
+        start = time.perf_counter()
+        try:
+            return TaskResult(name, value=task(cursor), seconds=time.perf_counter() - start)
+        except Exception as e:
+            return TaskResult(name, seconds=time.perf_counter() - start, error=e)
+        finally:
+            cursor.close()
+
+    with ThreadPoolExecutor(max_workers=workers or max(len(tasks), 1)) as pool:
+        futures = {name: pool.submit(run, name, task) for name, task in tasks.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    for result in results.values():
+        if result.error is None:
+            logger.info("Task %s took %.3fs", result.name, result.seconds)
+        else:
+            logger.error("Task %s failed after %.3fs: %s", result.name, result.seconds, result.error)
+    return results
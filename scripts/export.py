@@ -0,0 +1,163 @@
+import sys
+import json
+import shutil
+import logging
+import argparse
+from datetime import date
+
+from db import get_connection
+from lake import COMPRESSION, ROW_GROUP_SIZE, manifest_path, partition_dir, table_dir
+from profiling import StageReport, track_query
+
+logging.basicConfig(
+    filename = "logs/export.log",
+    encoding = "utf-8",
+    filemode = "a",
+    format = "{asctime} - {levelname} - {message}",
+    style = "{",
+    datefmt = "%Y-%m-%d %H:%M",
+    level = "DEBUG"
+)
+logger = logging.getLogger(__name__)
+
+ENRICHED_TABLE = "trips_enriched"  #table exported, built by scripts/transform.py
+
+#trips_enriched columns written to the files; color/year/month live in the directory names
+EXPORT_COLUMNS = [
+    "passenger_count", "trip_distance", "pickup_datetime", "dropoff_datetime", "trip_duration_sec",
+    "trip_co2_kgs", "avg_mph", "hour_of_day", "day_of_week", "week_of_year", "month_of_year",
+]
+
+
+#"color/yyyy-mm-dd" key of one partition in the lake manifest
+def partition_key(color: str, month_start):
+    return f"{color}/{month_start.isoformat()}"
+
+
+def read_manifest():
+    path = manifest_path()
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+#written to a temp file first so a reader never sees a half written manifest
+def write_manifest(manifest: dict):
+    path = manifest_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    tmp_path.replace(path)
+
+
+#(month, color, built_at, rows) of every partition the transform has built
+def built_partitions(con):
+    return con.execute("""
+        SELECT month_start, color, built_at, rows_out
+        FROM transform_manifest
+        ORDER BY month_start, color
+    """).fetchall()
+
+
+#writing one (month, color) partition as a single sorted, zstd compressed parquet file
+def export_partition(con, color: str, month_start, report=None):
+    out_dir = partition_dir(color, month_start)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    out_path = out_dir / "data_0.parquet"
+    tmp_path = out_dir / "data_0.parquet.tmp"
+    with track_query(report, con, f"export {color} {month_start}"):
+        con.execute(f"""
+            COPY (
+                SELECT {", ".join(EXPORT_COLUMNS)}
+                FROM {ENRICHED_TABLE}
+                WHERE color = $color
+                  AND pickup_datetime >= $month AND pickup_datetime < $month + INTERVAL 1 MONTH
+                ORDER BY pickup_datetime
+            ) TO '{tmp_path.as_posix()}' (FORMAT parquet, COMPRESSION {COMPRESSION}, ROW_GROUP_SIZE {ROW_GROUP_SIZE});
+        """, {"color": color, "month": month_start})
+    #swapped in atomically, queries running against the lake keep reading the old file
+    tmp_path.replace(out_path)
+    return out_path
+
+
+#dropping a partition directory and any parent left empty
+def remove_partition(color: str, month_start):
+    out_dir = partition_dir(color, month_start)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    for parent in (out_dir.parent, out_dir.parent.parent):
+        if parent.exists() and not any(parent.iterdir()):
+            parent.rmdir()
+
+
+#exporting trips_enriched to the parquet lake, only partitions rebuilt since their last export
+def export_trips(full_refresh: bool = False, profile: bool = False):
+
+    report = StageReport("export", profile)
+
+    try:
+        #the lake keeps its own manifest, so the export only ever reads the database
+        con = get_connection(read_only=True)
+        logger.info("Connected to DuckDB instance for EXPORT")
+
+        if full_refresh:
+            shutil.rmtree(table_dir(), ignore_errors=True)
+            logger.info("Full refresh requested, removed %s", table_dir())
+        manifest = read_manifest()
+
+        built = {partition_key(color, month_start): (color, month_start, str(built_at), rows)
+                 for month_start, color, built_at, rows in built_partitions(con)}
+
+        #partitions the transform no longer has
+        stale = [key for key in manifest if key not in built]
+        for key in stale:
+            entry = manifest.pop(key)
+            remove_partition(entry["color"], date.fromisoformat(entry["month_start"]))
+            logger.info("Removed stale lake partition %s", key)
+
+        #partitions rebuilt by the transform since they were exported
+        changed = [key for key, (_, _, built_at, _) in built.items()
+                   if manifest.get(key, {}).get("built_at") != built_at]
+        total_rows = 0
+        for key in changed:
+            color, month_start, built_at, rows = built[key]
+            with report.step(f"export {color} {month_start}") as record:
+                out_path = export_partition(con, color, month_start, report)
+                record["rows_out"] = rows
+            manifest[key] = {"color": color, "month_start": month_start.isoformat(), "built_at": built_at,
+                             "rows": rows, "bytes": out_path.stat().st_size}
+            #saved after every partition so an interrupted export resumes where it stopped
+            write_manifest(manifest)
+            total_rows += rows
+            logger.info("Exported %s (%s rows, %s bytes)", key, rows, manifest[key]["bytes"])
+        write_manifest(manifest)
+        con.close()
+
+        lake_bytes = sum(entry["bytes"] for entry in manifest.values())
+        report.set_total("partitions_exported", len(changed))
+        report.set_total("rows_out", total_rows)
+        report.set_total("lake_bytes", lake_bytes)
+
+        print(f"Partitions exported: {len(changed)}, removed: {len(stale)}, rows written: {total_rows:,}")
+        print(f"Lake {table_dir()}: {len(manifest)} partitions, {lake_bytes / 1e6:,.1f} MB")
+        logger.info("Partitions exported=%s, removed=%s, rows written=%s", len(changed), len(stale), total_rows)
+        logger.info("Lake size: %s partitions, %s bytes", len(manifest), lake_bytes)
+        return True
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+        return False
+
+    finally:
+        logger.info("Run report written to %s", report.write())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export trips_enriched as hive-partitioned parquet")
+    parser.add_argument("--full-refresh", action="store_true", help="delete the lake and export every partition")
+    parser.add_argument("--profile", action="store_true", help="include duckdb query profiles in the run report")
+    args = parser.parse_args()
+    ok = export_trips(full_refresh=args.full_refresh, profile=args.profile)
+    sys.exit(0 if ok else 1)
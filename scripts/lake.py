@@ -0,0 +1,45 @@
+import os
+from pathlib import Path
+
+#hive-partitioned parquet copy of trips_enriched, written by scripts/export.py
+#layout: data/lake/trips_enriched/color=<color>/year=<yyyy>/month=<m>/data_0.parquet
+#files are sorted by pickup_datetime and zstd compressed, so besides partition pruning on
+#color/year/month the row group min/max statistics let time filters skip row groups
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+#TAXI_LAKE_DIR moves the lake, e.g. onto a faster or shared disk
+lake_dir = Path(os.environ.get("TAXI_LAKE_DIR", project_root / "data" / "lake"))
+
+LAKE_TABLE = "trips_enriched"
+ROW_GROUP_SIZE = 122_880   #rows per row group (duckdb's default vector multiple)
+COMPRESSION = "zstd"
+
+#partition columns are typed explicitly instead of being sniffed from directory names
+HIVE_TYPES = "{'color': VARCHAR, 'year': INTEGER, 'month': INTEGER}"
+
+
+def table_dir(table: str = LAKE_TABLE):
+    return lake_dir / table
+
+
+#directory of one (color, month) partition
+def partition_dir(color: str, month_start, table: str = LAKE_TABLE):
+    return table_dir(table) / f"color={color}" / f"year={month_start.year}" / f"month={month_start.month}"
+
+
+#manifest of the exported partitions, kept next to the data it describes
+def manifest_path(table: str = LAKE_TABLE):
+    return table_dir(table) / "_manifest.json"
+
+
+#read_parquet(...) over the whole dataset; filters on color/year/month only open matching files
+def lake_source(table: str = LAKE_TABLE):
+    pattern = (table_dir(table) / "*" / "*" / "*" / "*.parquet").as_posix()
+    return f"read_parquet('{pattern}', hive_partitioning = true, hive_types = {HIVE_TYPES})"
+
+
+#true once at least one partition has been exported
+def lake_exists(table: str = LAKE_TABLE):
+    return any(table_dir(table).glob("*/*/*/*.parquet"))
@@ -1,14 +1,25 @@
-import duckdb
 import os
+import re
+import argparse
+import sys
 import logging
+import configparser
 from pathlib import Path
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from db import config_path, get_connection
+from download import download_files, read_meta
+from emissions import DIM_TABLE, load_emissions_dim
+from profiling import StageReport, track_query
+from result_cache import bump_data_version
+from schema import canonical_ddl, file_columns, match_era, pickup_window_sql, projection_sql
 
 #paths
 script_dir = Path(__file__).resolve().parent
 project_root = script_dir.parent
 logs_dir = project_root / "logs"
 data_dir   = project_root / "data"
-db_path = project_root / "emissions.duckdb"
 
 logs_dir.mkdir(parents=True, exist_ok=True)
 data_dir.mkdir(parents=True, exist_ok=True)
@@ -28,71 +39,322 @@ logger = logging.getLogger(__name__)
 CDN = "https://d37ci6vzurychx.cloudfront.net/trip-data"  #base url for taxi data
 YEARS = list(range(2015, 2025))  #full range of 2015-2024 years
 MONTHS = [f"{m:02d}" for m in range(1, 13)]
+COLORS = ["yellow", "green"]
+LOAD_WORKERS = 4          #months ingested at the same time
+WORKER_MEMORY = "2GB"     #memory budget for each load worker
+
+#which months/colors to load. values come from (lowest to highest priority): the full
+#YEARS x COLORS range, the [load] section of pipeline.ini, and arguments passed to load_parquet_files
+DEFAULT_SCOPE = {
+    "start_month": f"{YEARS[0]}-{MONTHS[0]}",
+    "end_month": f"{YEARS[-1]}-{MONTHS[-1]}",
+    "colors": " ".join(COLORS),
+}
+
+
+#resolving the months and colors of one load, e.g. a single quarter for a backfill
+def load_scope(start_month: str = None, end_month: str = None, colors=None):
+    scope = dict(DEFAULT_SCOPE)
+    if config_path.exists():
+        parser = configparser.ConfigParser()
+        parser.read(config_path)
+        if parser.has_section("load"):
+            scope.update({key: value for key, value in parser.items("load") if key in scope})
+    overrides = {"start_month": start_month, "end_month": end_month,
+                 "colors": " ".join(colors) if colors else None}
+    scope.update({key: value for key, value in overrides.items() if value})
+
+    months = month_range(scope["start_month"], scope["end_month"])
+    colors = scope["colors"].replace(",", " ").split()
+    unknown = [color for color in colors if color not in COLORS]
+    if unknown:
+        raise ValueError(f"unknown colors {unknown}, expected some of {COLORS}")
+    if not months:
+        raise ValueError(f"empty month range {scope['start_month']} to {scope['end_month']}")
+    return months, colors
+
+
+#first day of the month after d
+def next_month(d: date):
+    return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+
+
+#first day of every month from start to end inclusive, both given as YYYY-MM
+def month_range(start: str, end: str):
+    current, last = date.fromisoformat(f"{start}-01"), date.fromisoformat(f"{end}-01")
+    months = []
+    while current <= last:
+        months.append(current)
+        current = next_month(current)
+    return months
+
+
+#[start, end) pickup window covering the months
+def pickup_window(months):
+    return (datetime.combine(months[0], datetime.min.time()),
+            datetime.combine(next_month(months[-1]), datetime.min.time()))
+
+
+#first day of the month a source file covers, from its <color>_tripdata_YYYY-MM.parquet name
+def file_month(file_name: str):
+    match = re.search(r"_tripdata_(\d{4})-(\d{2})", file_name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+
+#pickup window of one file, pushed into its parquet scan: the file's own month within the scope window
+#it only depends on the file, so the rows kept for a month are the same whatever scope loaded it,
+#and changing the scope does not make already loaded files look changed
+def file_window(file_name: str, scope_window):
+    month = file_month(file_name)
+    if month is None:
+        return scope_window
+    own = pickup_window([month])
+    return (max(own[0], scope_window[0]), min(own[1], scope_window[1]))
+
+
+#building urls for the given months (all years and months by default) of one taxi color
+def build_urls(color: str, base_url: str = CDN, months=None):
+    if months is None:
+        return [
+            f"{base_url}/{color}_tripdata_{y}-{m}.parquet"
+            for y in YEARS
+            for m in MONTHS
+        ]
+    return [f"{base_url}/{color}_tripdata_{m.year}-{m.month:02d}.parquet" for m in months]
+
+
+#creating the trips table and the load manifest if this is the first run
+def ensure_tables(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS trips_all (
+            {canonical_ddl()}
+        );
+    """)
+    #one row per monthly source file that has been ingested into trips_all
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS load_manifest (
+            file_name     VARCHAR PRIMARY KEY,
+            color         VARCHAR,
+            file_size     BIGINT,
+            etag          VARCHAR,
+            last_modified VARCHAR,
+            row_count     BIGINT,
+            loaded_at     TIMESTAMP,
+            pickup_window VARCHAR
+        );
+    """)
+    #manifests created before the pickup window was recorded
+    con.execute("ALTER TABLE load_manifest ADD COLUMN IF NOT EXISTS pickup_window VARCHAR;")
+    #which schema era each source file matched, era is NULL for files that matched none
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS schema_report (
+            file_name  VARCHAR PRIMARY KEY,
+            color      VARCHAR,
+            era        VARCHAR,
+            columns    VARCHAR,
+            checked_at TIMESTAMP
+        );
+    """)
+
+
+#size and version info for one downloaded source file: the remote ETag/Last-Modified the
+#downloader recorded, or the local mtime for files placed in data/ by hand
+def source_fingerprint(source: str):
+    stat = os.stat(source)
+    remote = read_meta(source) or {}
+    return {"file_size": stat.st_size, "etag": remote.get("etag"),
+            "last_modified": remote.get("last_modified") or str(int(stat.st_mtime))}
+
+
+#true when the file was never loaded, its size/etag/mtime differs from the manifest, or it was
+#loaded with a different pickup window (rows outside the old window were never read)
+def needs_load(con, file_name: str, fingerprint: dict):
+    row = con.execute("""
+        SELECT file_size, etag, last_modified, pickup_window FROM load_manifest WHERE file_name = ?
+    """, [file_name]).fetchone()
+    if row is None:
+        return True
+    return row != (fingerprint["file_size"], fingerprint["etag"], fingerprint["last_modified"],
+                   fingerprint["pickup_window"])
+
+
+#matching a file to a schema era and recording the result, returns (era, columns)
+def check_schema(con, color: str, source: str):
+    columns = file_columns(con, source)
+    era = match_era(color, columns)
+    described = ", ".join(f"{name} {col_type}" for name, col_type in columns.values())
+    con.execute("""
+        INSERT OR REPLACE INTO schema_report VALUES (?, ?, ?, ?, now()::TIMESTAMP);
+    """, [os.path.basename(source), color, era, described])
+    return era, columns
+
+
+#replacing one month of one color: delete its old rows, insert the file, update the manifest
+#only the projected columns are read and pickups outside window = (start, end) are filtered in the scan
+def load_month(con, color: str, source: str, fingerprint: dict, columns: dict, window, report=None):
+    file_name = os.path.basename(source)
 
-#building urls for all years and months for both yellow and green taxi data
-def build_urls(color: str):
-    return [
-        f"{CDN}/{color}_tripdata_{y}-{m}.parquet"
-        for y in YEARS
-        for m in MONTHS
-    ]
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        con.execute("DELETE FROM trips_all WHERE source_file = ?;", [file_name])
+        with track_query(report, con, f"load {file_name}") as record:
+            row_count = con.execute(f"""
+                INSERT INTO trips_all
+                SELECT
+                {projection_sql(color, columns)}
+                FROM read_parquet(?)
+                WHERE {pickup_window_sql(color, columns)}
+                --each file is one color, sorting by pickup keeps row group min/max ranges tight
+                ORDER BY pickup_datetime;
+            """, [color, file_name, source, *window]).fetchone()[0]
+            record["rows_out"] = row_count
+        con.execute("""
+            INSERT OR REPLACE INTO load_manifest
+                (file_name, color, file_size, etag, last_modified, row_count, loaded_at, pickup_window)
+            VALUES (?, ?, ?, ?, ?, ?, now()::TIMESTAMP, ?);
+        """, [file_name, color, fingerprint["file_size"], fingerprint["etag"],
+              fingerprint["last_modified"], row_count, fingerprint["pickup_window"]])
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+
+    return row_count
+
+
+#splitting a size string like "2GB" so the per-worker budget can be scaled by worker count
+def scale_memory(budget: str, factor: int):
+    number = "".join(ch for ch in budget if ch.isdigit() or ch == ".")
+    unit = budget[len(number):].strip() or "B"
+    return f"{float(number) * factor:g}{unit}"
+
+
+#bounding duckdb to workers x per-worker memory, spilling anything beyond that to the temp directory
+#threads stay as db.py resolves them (every core unless pipeline.ini/TAXI_DUCKDB_THREADS say otherwise):
+#the concurrent months share one pool, so each parquet scan can still use the whole machine
+def worker_settings(workers: int, worker_memory: str):
+    return {
+        "memory_limit": scale_memory(worker_memory, workers),
+        #inserts do not need to keep file order, which lets duckdb stream them instead of buffering
+        "preserve_insertion_order": "false",
+    }
+
+
+#running each month as its own unit of work, each worker on its own cursor of the same database
+def load_months_parallel(con, jobs, workers: int, report=None):
+    loaded, failed = 0, 0
+
+    def run(job):
+        color, source, fingerprint, columns, window = job
+        cursor = con.cursor()
+        try:
+            return load_month(cursor, color, source, fingerprint, columns, window, report)
+        finally:
+            cursor.close()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures = {pool.submit(run, job): job for job in jobs}
+        for future in as_completed(futures):
+            file_name = os.path.basename(futures[future][1])
+            try:
+                rows = future.result()
+            except Exception as e:
+                failed += 1
+                logger.error("Failed loading %s: %s", file_name, e)
+                continue
+            loaded += 1
+            logger.info("Loaded %s (%s rows)", file_name, rows)
+
+    return loaded, failed
 
 
 #loading and aggragating specific .parquet files with only needed columns
-def load_parquet_files():
+def load_parquet_files(full_refresh: bool = False, base_url: str = CDN, workers: int = 8,
+                       load_workers: int = LOAD_WORKERS, worker_memory: str = WORKER_MEMORY,
+                       profile: bool = False, dest_dir: Path = data_dir,
+                       start_month: str = None, end_month: str = None, colors=None):
 
     con = None
+    report = StageReport("load", profile)
 
     try:
+        months, colors = load_scope(start_month, end_month, colors)
+        scope_window = pickup_window(months)
+        logger.info("Load scope: %s to %s, colors %s", months[0], months[-1], colors)
+
+        #download stage: fetch every month in scope concurrently into data/, cached files are reused
+        local_paths = {}
+        for color in colors:
+            with report.step(f"download {color}") as record:
+                urls = build_urls(color, base_url, months)
+                downloaded = download_files(urls, dest_dir, workers=workers)
+                local_paths[color] = [downloaded[url] for url in urls if downloaded[url] is not None]
+                record["rows_out"] = len(local_paths[color])
+            logger.info("%s: %s of %s monthly files available locally", color, len(local_paths[color]), len(urls))
+
         # Connect to local DuckDB instance
-        con = duckdb.connect(database=str(db_path), read_only=False)
+        con = get_connection(**worker_settings(load_workers, worker_memory))
         logger.info("Connected to DuckDB instance for LOADING")
-        # Define the file paths and URLs
-        con.execute("INSTALL httpfs;")
-        con.execute("LOAD httpfs;")
         con.execute("SET enable_object_cache=true;")
 
-        #build urls
-        #loading multiple file sources programatically, instead of statically
-        yellow_urls = build_urls("yellow")
-        green_urls  = build_urls("green")
-
-
-        con.execute(f"""
-            CREATE OR REPLACE TABLE yellow_all AS
-            SELECT 'yellow' as color,
-            passenger_count, 
-            trip_distance, 
-            tpep_pickup_datetime AS pickup_datetime, tpep_dropoff_datetime AS dropoff_datetime
-            FROM read_parquet(?, union_by_name = TRUE);
-        """, [yellow_urls])
-        con.execute(f"""
-            CREATE OR REPLACE TABLE green_all AS
-            SELECT 
-            'green' as color,
-            passenger_count, 
-            trip_distance, 
-            lpep_pickup_datetime AS pickup_datetime, lpep_dropoff_datetime AS dropoff_datetime
-            FROM read_parquet(?, union_by_name = TRUE);
-        """, [green_urls])
-
-        #both colors in one table
-        con.execute("""
-            CREATE OR REPLACE TABLE trips_all AS
-            SELECT * FROM yellow_all
-            UNION ALL
-            SELECT * FROM green_all;
-        """)
+        #full refresh throws away everything loaded so far and re-ingests every month in scope
+        if full_refresh:
+            con.execute("DROP TABLE IF EXISTS trips_all;")
+            con.execute("DROP TABLE IF EXISTS load_manifest;")
+            con.execute("DROP TABLE IF EXISTS schema_report;")
+            logger.info("Full refresh requested, dropped trips_all, load_manifest and schema_report")
+        ensure_tables(con)
+
+        #only months that are new or whose source changed get re-read
+        #months outside the scope are neither read nor deleted
+        jobs, skipped, unmatched = [], 0, []
+        for color in colors:
+            for path in local_paths[color]:
+                source = path.as_posix()
+                fingerprint = source_fingerprint(source)
+                window = file_window(path.name, scope_window)
+                fingerprint["pickup_window"] = f"{window[0]:%Y-%m-%d}/{window[1]:%Y-%m-%d}"
+
+                if not needs_load(con, path.name, fingerprint):
+                    skipped += 1
+                    continue
+
+                #files that match no known schema era are reported and left out of trips_all
+                era, columns = check_schema(con, color, source)
+                if era is None:
+                    unmatched.append(path.name)
+                    logger.warning("%s matches no known schema era, skipped: %s", path.name, columns)
+                    continue
+                jobs.append((color, source, fingerprint, columns, window))
+
+        if unmatched:
+            print(f"Files matching no known schema era ({len(unmatched)}): {', '.join(unmatched)}")
+
+        #analysis results cached for the previous contents are no longer valid
+        if jobs:
+            bump_data_version(con, "load")
+
+        #months go straight into trips_all, no per-color intermediate tables
+        loaded, failed = load_months_parallel(con, jobs, load_workers, report)
+        failed += len(unmatched)
+        report.set_total("files_loaded", loaded)
+        report.set_total("files_unchanged", skipped)
+        report.set_total("files_failed", failed)
 
-        trips_count = con.execute("SELECT COUNT(*) FROM trips_all").fetchone()[0]
-        avg_dist    = con.execute("SELECT AVG(trip_distance) FROM trips_all").fetchone()[0]
-        avg_passenger  = con.execute("SELECT AVG(passenger_count) FROM trips_all").fetchone()[0]
+        print(f"Files loaded: {loaded}, unchanged: {skipped}, failed: {failed}")
+        logger.info("Files loaded=%s, unchanged=%s, failed=%s", loaded, skipped, failed)
+
+        trips_count, avg_dist, avg_passenger = con.execute("""
+            SELECT COUNT(*), AVG(trip_distance), AVG(passenger_count) FROM trips_all
+        """).fetchone()
+
+        report.set_total("rows_out", trips_count)
 
         #print statements for rows of each table  and basic stats
-        print("Rows trips_2024: ", trips_count)
+        print("Rows trips_all: ", trips_count)
         logger.info(f"Trips_all row count: {trips_count}")
 
-  
+
         print("Avg trip distance: ", avg_dist)
         print("Avg passenger count: ",  avg_passenger)
         logger.info(f"Average trip distance: {avg_dist}")
@@ -110,6 +372,11 @@ def load_parquet_files():
             emissions_count = con.execute("SELECT COUNT(*) FROM emissions_lookup").fetchone()[0]
             print("Rows emissions_lookup:", emissions_count)
             logger.info("emissions_lookup row count: %s", emissions_count)
+
+            #date-ranged co2 factors per taxi color, what the transform actually applies
+            dim_count = load_emissions_dim(con)
+            print(f"Rows {DIM_TABLE}:", dim_count)
+            logger.info("%s row count: %s", DIM_TABLE, dim_count)
         else:
             logger.warning("vehicle_emissions.csv not found at %s; skipped loading.", emissions_csv)
 
@@ -117,9 +384,37 @@ def load_parquet_files():
         logger.info("Data loaded and simple aggregations done on ingested data. Both green and yellow taxi data are in one table with only needed columns and emissions data is in a separate table.")
         con.close()
 
+        #the months that did load stay loaded, but the stage fails so the pipeline does not record
+        #its fingerprint and the next run retries the missing months
+        if failed:
+            print(f"Load incomplete: {failed} file(s) failed or match no known schema era")
+            logger.error("Load incomplete: %s file(s) failed or match no known schema era", failed)
+            return False
+        return True
+
     except Exception as e:
         print(f"An error occurred: {e}")
         logger.error(f"An error occurred: {e}")
+        return False
+
+    finally:
+        logger.info("Run report written to %s", report.write())
 
 if __name__ == "__main__":
-    load_parquet_files()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load NYC taxi trip parquet files into DuckDB")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="drop trips_all and the load manifest and re-ingest every month")
+    parser.add_argument("--base-url", default=CDN,
+                        help="where monthly parquet files are downloaded from (e.g. a local http.server)")
+    parser.add_argument("--workers", type=int, default=8, help="number of concurrent downloads")
+    parser.add_argument("--load-workers", type=int, default=LOAD_WORKERS, help="number of months ingested at once")
+    parser.add_argument("--worker-memory", default=WORKER_MEMORY, help="duckdb memory budget per load worker, e.g. 2GB")
+    parser.add_argument("--profile", action="store_true", help="include duckdb query profiles in the run report")
+    parser.add_argument("--start-month", help=f"first month to load, YYYY-MM (default {DEFAULT_SCOPE['start_month']})")
+    parser.add_argument("--end-month", help=f"last month to load, YYYY-MM (default {DEFAULT_SCOPE['end_month']})")
+    parser.add_argument("--colors", nargs="+", choices=COLORS, help="taxi colors to load (default both)")
+    args = parser.parse_args()
+    ok = load_parquet_files(full_refresh=args.full_refresh, base_url=args.base_url, workers=args.workers,
+                            load_workers=args.load_workers, worker_memory=args.worker_memory, profile=args.profile,
+                            start_month=args.start_month, end_month=args.end_month, colors=args.colors)
+    sys.exit(0 if ok else 1)
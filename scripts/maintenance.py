@@ -0,0 +1,145 @@
+import sys
+import logging
+import argparse
+from pathlib import Path
+
+from db import get_connection
+from profiling import StageReport
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+logs_dir = project_root / "logs"
+
+logger = logging.getLogger(__name__)
+
+#physical order of the trips tables; duckdb keeps min/max zone maps per row group, so rows
+#clustered by these keys let WHERE color = ? and pickup time ranges skip whole row groups
+CLUSTER_KEYS = ["color", "pickup_datetime"]
+TRIPS_TABLES = ["trips_all", "trips_clean", "trips_enriched"]
+
+
+#row groups of a table, from its storage info
+def row_group_count(con, table: str):
+    return con.execute("SELECT COUNT(DISTINCT row_group_id) FROM pragma_storage_info(?)", [table]).fetchone()[0]
+
+
+#rewriting a table in CLUSTER_KEYS order. incremental loads and partition rebuilds append to the
+#end of a table and leave deleted rows behind; this puts every color and month back in one run
+def recluster(con, table: str):
+    keys = ", ".join(CLUSTER_KEYS)
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        con.execute(f"CREATE OR REPLACE TABLE {table}__clustered AS SELECT * FROM {table} ORDER BY {keys};")
+        con.execute(f"DROP TABLE {table};")
+        con.execute(f"ALTER TABLE {table}__clustered RENAME TO {table};")
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    #checkpointing writes the new row groups and frees the old table's blocks
+    con.execute("CHECKPOINT;")
+
+
+#fraction of a table's rows duckdb actually scans for a color filter and for a one month filter,
+#next to the fraction that matches. close numbers mean the zone maps prune well
+def scan_fractions(con, table: str, report: StageReport):
+    total = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    if not total:
+        return {}
+    color, month = con.execute(f"""
+        SELECT color, date_trunc('month', pickup_datetime)::DATE
+        FROM {table} WHERE pickup_datetime IS NOT NULL
+        GROUP BY ALL ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()
+    filters = {
+        "color": ("color = $color", {"color": color}),
+        "month": ("pickup_datetime >= $month AND pickup_datetime < $month + INTERVAL 1 MONTH", {"month": month}),
+    }
+
+    fractions = {"rows": total, "row_groups": row_group_count(con, table)}
+    for name, (where, params) in filters.items():
+        #summing a non-filter column forces a real scan instead of a count from metadata;
+        #fetchall lets the query finish so its profile gets written
+        with report.query(con, f"{table} {name} filter") as record:
+            matched = con.execute(f"""
+                SELECT COUNT(*), SUM(trip_distance) FROM {table} WHERE {where}
+            """, params).fetchall()[0][0]
+        scanned = record.get("cumulative_rows_scanned", total)
+        fractions[f"{name}_matched"] = round(matched / total, 4)
+        fractions[f"{name}_scanned"] = round(scanned / total, 4)
+    return fractions
+
+
+#printing and logging the scan fractions of every trips table
+def zone_map_report(con, tables, report: StageReport):
+    results = {}
+    for table in tables:
+        results[table] = fractions = scan_fractions(con, table, report)
+        report.set_total(table, fractions)
+        if not fractions:
+            continue
+        print(f"{table}: {fractions['rows']:,} rows in {fractions['row_groups']} row groups")
+        for name in ("color", "month"):
+            print(f"  {name} filter: matches {fractions[f'{name}_matched']:.1%} of rows, "
+                  f"scans {fractions[f'{name}_scanned']:.1%}")
+        logger.info("Zone maps %s: %s", table, fractions)
+    return results
+
+
+#existing trips tables among the requested ones
+def existing_tables(con, tables):
+    present = {row[0] for row in con.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    return [table for table in tables if table in present]
+
+
+def run_maintenance(command: str, tables=None, profile: bool = False):
+    report = StageReport(f"maintenance_{command}", profile)
+    try:
+        con = get_connection(read_only=command == "zonemaps")
+        tables = existing_tables(con, tables or TRIPS_TABLES)
+
+        if command == "recluster":
+            for table in tables:
+                before = row_group_count(con, table)
+                with report.step(f"recluster {table}") as record:
+                    recluster(con, table)
+                after = row_group_count(con, table)
+                record["rows_out"] = con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                print(f"Reclustered {table} by ({', '.join(CLUSTER_KEYS)}): {before} -> {after} row groups")
+                logger.info("Reclustered %s: %s -> %s row groups", table, before, after)
+
+        zone_map_report(con, tables, report)
+        con.close()
+        return True
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+        return False
+
+    finally:
+        logger.info("Run report written to %s", report.write())
+
+
+if __name__ == "__main__":
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename = str(logs_dir/"maintenance.log"),
+        encoding = "utf-8",
+        filemode = "a",
+        format = "{asctime} - {levelname} - {message}",
+        style = "{",
+        datefmt = "%Y-%m-%d %H:%M",
+        level = "DEBUG"
+    )
+
+    parser = argparse.ArgumentParser(description="Maintenance of the trips tables")
+    parser.add_argument("command", choices=["recluster", "zonemaps"],
+                        help="recluster: rewrite tables in (color, pickup_datetime) order; "
+                             "zonemaps: report how much of each table color/month filters scan")
+    parser.add_argument("--tables", nargs="+", choices=TRIPS_TABLES, help="tables to work on (default all)")
+    parser.add_argument("--profile", action="store_true", help="include duckdb query profiles in the run report")
+    args = parser.parse_args()
+    ok = run_maintenance(args.command, args.tables, args.profile)
+    sys.exit(0 if ok else 1)
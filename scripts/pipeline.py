@@ -0,0 +1,214 @@
+import sys
+import json
+import time
+import hashlib
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from db import connection_settings
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+logs_dir = project_root / "logs"
+data_dir = project_root / "data"
+state_path = data_dir / "pipeline_state.json"
+emissions_csv = data_dir / "vehicle_emissions.csv"
+config_path = project_root / "pipeline.ini"
+factors_csv = data_dir / "emissions_factors.csv"
+
+logs_dir.mkdir(parents=True, exist_ok=True)
+
+logging.basicConfig(
+    filename = str(logs_dir/"pipeline.log"),
+    encoding = "utf-8",
+    filemode = "a",
+    format = "{asctime} - {levelname} - {message}",
+    style = "{",
+    datefmt = "%Y-%m-%d %H:%M",
+    level = "DEBUG"
+)
+logger = logging.getLogger(__name__)
+
+#shared modules every stage imports, a change to them re-runs every stage
+SHARED_CODE = ["db.py", "profiling.py", "result_cache.py"]
+
+#stage DAG: upstream stages and the code files that define each stage (scripts/<stage>.py runs it)
+STAGES = {
+    "load":      {"deps": [],            "code": ["load.py", "download.py", "schema.py", "emissions.py"]},
+    "clean":     {"deps": ["load"],      "code": ["clean.py", "dedup.py"]},
+    "transform": {"deps": ["clean"],     "code": ["transform.py", "emissions.py", "approx.py"]},
+    "export":    {"deps": ["transform"], "code": ["export.py", "lake.py"]},
+    "analysis":  {"deps": ["transform"], "code": ["analysis.py", "executor.py", "lake.py", "approx.py", "plots.py"]},
+}
+
+
+#sha256 of a file's bytes, None if it does not exist
+def file_hash(path: Path):
+    if not path.exists():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+#hash of any json-serializable value
+def value_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+#external inputs of a stage that are not another stage's output
+def external_inputs(stage: str):
+    if stage != "load":
+        return None
+    #monthly source files by name/size/mtime (stat only, no reads) plus the emissions csv contents
+    files = sorted(
+        (path.name, stat.st_size, int(stat.st_mtime))
+        for path in data_dir.glob("*_tripdata_*.parquet")
+        for stat in [path.stat()]
+    )
+    #pipeline.ini holds the load scope ([load]) and connection settings ([duckdb])
+    return {"files": files, "emissions_csv": file_hash(emissions_csv), "factors_csv": file_hash(factors_csv),
+            "config": file_hash(config_path)}
+
+
+#fingerprint of one stage: its code, its external inputs and its upstream stages' fingerprints
+def stage_fingerprint(stage: str, fingerprints: dict):
+    spec = STAGES[stage]
+    code = {name: file_hash(script_dir / name) for name in spec["code"] + SHARED_CODE}
+    return value_hash({
+        "code": code,
+        "inputs": external_inputs(stage),
+        "upstream": {dep: fingerprints.get(dep) for dep in spec["deps"]},
+    })
+
+
+def read_state():
+    if not state_path.exists():
+        return {}
+    with open(state_path) as f:
+        return json.load(f)
+
+
+def write_state(state: dict):
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump(state, f, indent=2)
+
+
+#the given stages plus every stage downstream of them
+def with_descendants(stages):
+    selected = set(stages)
+    changed = True
+    while changed:
+        changed = False
+        for stage, spec in STAGES.items():
+            if stage not in selected and selected.intersection(spec["deps"]):
+                selected.add(stage)
+                changed = True
+    return selected
+
+
+#stages grouped into levels; all stages of a level only depend on earlier levels
+def stage_levels():
+    levels, placed = [], set()
+    while len(placed) < len(STAGES):
+        level = [s for s, spec in STAGES.items() if s not in placed and all(d in placed for d in spec["deps"])]
+        if not level:
+            raise ValueError("stage dependencies contain a cycle")
+        levels.append(level)
+        placed.update(level)
+    return levels
+
+
+#running one stage script in its own process (so it keeps its own log file), True on success
+def run_stage(stage: str, options: dict):
+    command = [sys.executable, str(script_dir / f"{stage}.py"), *options.get(stage, [])]
+    logger.info("Running %s", " ".join(command))
+    return subprocess.run(command, cwd=project_root).returncode == 0
+
+
+#running the DAG, skipping every stage whose fingerprint matches its last successful run
+def run_pipeline(force=(), fetch: bool = False, jobs: int = 1, options: dict = None):
+    options = options or {}
+    #a forced stage produces new output even when its fingerprint is unchanged, so its dependents run too
+    force = with_descendants(force)
+    state = read_state()
+    #the database the stages will open: pipeline.ini's [duckdb] database, overridden by TAXI_DUCKDB_PATH
+    database = Path(connection_settings()["database"])
+    if not database.exists():
+        #nothing is up to date without a database
+        state = {}
+
+    fingerprints, summary = {}, {}
+    for level in stage_levels():
+        to_run = []
+        for stage in level:
+            fingerprint = stage_fingerprint(stage, fingerprints)
+            #an upstream stage that failed, or was itself blocked, blocks its dependents
+            blocked = [dep for dep in STAGES[stage]["deps"] if summary.get(dep) in ("failed", "blocked")]
+            if blocked:
+                summary[stage] = "blocked"
+                #its upstream may have changed part way, so it must run again once unblocked
+                state.pop(stage, None)
+                continue
+            unchanged = state.get(stage, {}).get("fingerprint") == fingerprint
+            #--fetch always runs the load so it can check the CDN for new months
+            if unchanged and stage not in force and not (fetch and stage == "load"):
+                fingerprints[stage] = fingerprint
+                summary[stage] = "skipped"
+                logger.info("Stage %s unchanged, skipped", stage)
+                continue
+            to_run.append(stage)
+
+        #stages of one level are independent and may run together
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+            started = time.perf_counter()
+            results = dict(zip(to_run, pool.map(lambda s: run_stage(s, options), to_run)))
+
+        for stage, ok in results.items():
+            if not ok:
+                summary[stage] = "failed"
+                state.pop(stage, None)
+                logger.error("Stage %s failed", stage)
+                continue
+            summary[stage] = "ran"
+            #without every upstream fingerprint the stage's own would not describe its inputs
+            if any(fingerprints.get(dep) is None for dep in STAGES[stage]["deps"]):
+                state.pop(stage, None)
+                logger.warning("Stage %s ran without upstream fingerprints, state not saved", stage)
+                continue
+            #fingerprint after the run, the load may have downloaded new files
+            fingerprints[stage] = stage_fingerprint(stage, fingerprints)
+            state[stage] = {"fingerprint": fingerprints[stage], "finished_at": datetime.now().isoformat(timespec="seconds")}
+            logger.info("Stage %s ran (level took %.2fs)", stage, time.perf_counter() - started)
+        write_state(state)
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run load -> clean -> transform -> export/analysis, skipping unchanged stages")
+    parser.add_argument("--force", nargs="*", default=[], choices=list(STAGES),
+                        help="stages to run even if unchanged (downstream stages follow automatically)")
+    parser.add_argument("--fetch", action="store_true", help="run the load to check the CDN for new or changed months")
+    parser.add_argument("--jobs", type=int, default=1, help="independent stages run at the same time")
+    parser.add_argument("--load-workers", type=int, default=None, help="months ingested in parallel by the load stage")
+    args = parser.parse_args()
+
+    options = {"load": ["--load-workers", str(args.load_workers)]} if args.load_workers else {}
+    start = time.perf_counter()
+    try:
+        summary = run_pipeline(force=args.force, fetch=args.fetch, jobs=args.jobs, options=options)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+        sys.exit(1)
+
+    for stage, status in summary.items():
+        print(f"{stage:<10} {status}")
+    print(f"Pipeline finished in {time.perf_counter() - start:.2f}s")
+    logger.info("Pipeline finished in %.2fs: %s", time.perf_counter() - start, summary)
+    sys.exit(1 if "failed" in summary.values() else 0)
@@ -0,0 +1,144 @@
+import os
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")  #files only, no display needed
+import matplotlib.pyplot as plt
+
+#charts of the co2 rollup for both colors, rendered straight from numpy arrays
+#every figure is cached under the fingerprint of the rollup it was drawn from, so a run on
+#unchanged data reuses the png files instead of re-rendering them
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+#TAXI_OUTPUTS_DIR moves the charts and their cache, e.g. away from the real ones during benchmarks
+outputs_dir = Path(os.environ.get("TAXI_OUTPUTS_DIR", project_root / "outputs"))
+cache_path = outputs_dir / ".plot_cache.json"
+
+logger = logging.getLogger(__name__)
+
+PLOT_VERSION = 1   #bump when a chart changes so cached figures are re-rendered
+COLORS = {"yellow": "#f2b705", "green": "#2e8b57"}
+DOW_NAMES = ["Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"]
+
+#total co2 per color and calendar month over the whole rollup
+MONTHLY_SQL = """
+SELECT color, date_trunc('month', pickup_date)::DATE AS month_start, SUM(co2_kgs) AS co2
+FROM co2_rollup_hourly
+GROUP BY ALL
+ORDER BY month_start
+"""
+
+#average co2 per (day, hour) cell by weekday and hour of day
+HEATMAP_SQL = """
+SELECT color, dayofweek(pickup_date)::INTEGER AS dow, hour_of_day::INTEGER AS h, AVG(co2_kgs) AS co2
+FROM co2_rollup_hourly
+GROUP BY ALL
+"""
+
+
+#fingerprint of the rollup: it changes exactly when the transform rebuilds or removes a partition
+def rollup_fingerprint(con):
+    count, digest = con.execute("""
+        SELECT COUNT(*), bit_xor(hash(month_start, color, built_at)) FROM transform_manifest
+    """).fetchone()
+    return f"v{PLOT_VERSION}-{count}-{digest}"
+
+
+def read_cache():
+    if not cache_path.exists():
+        return {}
+    with open(cache_path) as f:
+        return json.load(f)
+
+
+def write_cache(cache: dict):
+    outputs_dir.mkdir(parents=True, exist_ok=True)
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=2)
+
+
+#monthly totals as a (months,) datetime64 axis and a {color: (months,) array} with every month
+#between the first and last one, months without trips are NaN so gaps show as gaps
+def monthly_series(con):
+    data = con.execute(MONTHLY_SQL).fetchnumpy()
+    months = data["month_start"].astype("datetime64[M]")
+    axis = np.arange(months.min(), months.max() + 1, dtype="datetime64[M]")
+    series = {}
+    for color in COLORS:
+        mask = data["color"] == color
+        values = np.full(axis.shape, np.nan)
+        values[(months[mask] - axis[0]).astype(int)] = data["co2"][mask]
+        series[color] = values
+    return axis, series
+
+
+#{color: 7 x 24 array} of average co2 per weekday (0=Sun) and hour
+def hourly_heatmaps(con):
+    data = con.execute(HEATMAP_SQL).fetchnumpy()
+    grids = {}
+    for color in COLORS:
+        mask = data["color"] == color
+        grid = np.full((7, 24), np.nan)
+        grid[data["dow"][mask], data["h"][mask]] = data["co2"][mask]
+        grids[color] = grid
+    return grids
+
+
+def plot_monthly(data, out_path: Path):
+    axis, series = data
+    fig, ax = plt.subplots(figsize=(14, 5))
+    dates = axis.astype("datetime64[D]")
+    for color, values in series.items():
+        ax.plot(dates, values, label=color.capitalize(), color=COLORS[color], linewidth=1.5)
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Total CO₂ (kg)")
+    ax.set_title(f"Monthly Taxi CO₂ Totals by Color, {axis[0]} to {axis[-1]}")
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=150)
+    plt.close(fig)
+
+
+def plot_heatmaps(grids, out_path: Path):
+    fig, axes = plt.subplots(len(grids), 1, figsize=(12, 3 * len(grids)), sharex=True)
+    for ax, (color, grid) in zip(np.atleast_1d(axes), grids.items()):
+        image = ax.imshow(grid, aspect="auto", cmap="viridis")
+        ax.set_yticks(range(7), DOW_NAMES)
+        ax.set_title(f"{color.capitalize()}: average CO₂ per hour (kg)")
+        fig.colorbar(image, ax=ax)
+    np.atleast_1d(axes)[-1].set_xticks(range(24))
+    np.atleast_1d(axes)[-1].set_xlabel("Hour of day")
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=150)
+    plt.close(fig)
+
+
+#figures rendered by render_plots: file name -> (data function, plot function)
+FIGURES = {
+    "monthly_co2_by_color.png": (monthly_series, plot_monthly),
+    "hourly_co2_heatmap.png": (hourly_heatmaps, plot_heatmaps),
+}
+
+
+#rendering every figure whose rollup fingerprint changed, returns {path: "rendered" | "cached"}
+def render_plots(con, force: bool = False):
+    outputs_dir.mkdir(parents=True, exist_ok=True)
+    fingerprint = rollup_fingerprint(con)
+    cache = read_cache()
+    status = {}
+    for name, (load, plot) in FIGURES.items():
+        out_path = outputs_dir / name
+        if not force and cache.get(name) == fingerprint and out_path.exists():
+            status[out_path] = "cached"
+            continue
+        plot(load(con), out_path)
+        cache[name] = fingerprint
+        status[out_path] = "rendered"
+        logger.info("Rendered %s", out_path)
+    write_cache(cache)
+    return status
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import resource
+import tempfile
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager, nullcontext
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+reports_dir = project_root / "logs" / "reports"
+
+#duckdb json profile fields kept for every query
+PROFILE_METRICS = ["latency", "rows_returned", "cumulative_rows_scanned", "total_bytes_read",
+                   "total_bytes_written", "system_peak_buffer_memory", "system_peak_temp_dir_size"]
+
+
+#true when full operator profiles (the EXPLAIN ANALYZE tree) should go into the report
+def profiling_requested(flag: bool = False):
+    return flag or os.environ.get("TAXI_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+#peak resident memory of this process in bytes (ru_maxrss is KB on linux, bytes on macos)
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+#machine-readable record of one stage run, written as json to logs/reports/
+class StageReport:
+    def __init__(self, stage: str, profile: bool = False):
+        self.stage = stage
+        self.profile = profiling_requested(profile)
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.steps = []
+        self.totals = {}
+        self.lock = threading.Lock()
+
+    #timing a block of python work; the caller can fill rows_in/rows_out on the yielded dict
+    @contextmanager
+    def step(self, name: str):
+        record = {"name": name, "kind": "step", "rows_in": None, "rows_out": None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            with self.lock:
+                self.steps.append(record)
+
+    #timing queries run on con inside the block; duckdb's json profile of the last query in the block
+    #adds rows/bytes scanned. con must not be shared with another thread meanwhile (use a cursor per thread)
+    @contextmanager
+    def query(self, con, name: str):
+        record = {"name": name, "kind": "query", "rows_in": None, "rows_out": None}
+        fd, profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+        os.close(fd)
+        con.execute("SET enable_profiling = 'json';")
+        con.execute(f"SET profiling_output = '{profile_path}';")
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = round(time.perf_counter() - start, 6)
+            con.execute("PRAGMA disable_profiling;")
+            metrics = self.read_profile(profile_path)
+            if record["rows_out"] is None:
+                record["rows_out"] = metrics.get("rows_returned")
+            record.update(metrics)
+            with self.lock:
+                self.steps.append(record)
+
+    #summary metrics of the last query profiled into path, plus the operator tree if requested
+    def read_profile(self, path: str):
+        try:
+            with open(path) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        finally:
+            Path(path).unlink(missing_ok=True)
+        metrics = {key: profile[key] for key in PROFILE_METRICS if key in profile}
+        if self.profile:
+            metrics["profile"] = profile
+        return metrics
+
+    #stage level counters such as total rows in/out
+    def set_total(self, key: str, value):
+        self.totals[key] = value
+
+    #writing the report next to the logs and returning its path
+    def write(self):
+        reports_dir.mkdir(parents=True, exist_ok=True)
+        report = {
+            "stage": self.stage,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "seconds": round(time.perf_counter() - self.start, 6),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "totals": self.totals,
+            "steps": self.steps,
+        }
+        path = reports_dir / f"{self.stage}_{self.started_at:%Y%m%d_%H%M%S}.json"
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+        return path
+
+
+#report.query(con, name) when a report is being collected, otherwise a no-op block
+def track_query(report, con, name: str):
+    if report is None:
+        return nullcontext({})
+    return report.query(con, name)
@@ -0,0 +1,138 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+from lake import manifest_path
+
+#on-disk cache of query results for scripts/analysis.py
+#an entry is a parquet file named after a hash of the normalized sql, its bound parameters and the
+#data version; load/clean/transform bump that version whenever they change the database, so a
+#repeated analysis on unchanged data reads every result back from the cache instead of recomputing it
+#files are written and read by duckdb itself (COPY ... TO / read_parquet), so lists, maps and dates
+#come back with their original types. the least recently used entries are evicted past max_bytes
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+#TAXI_RESULT_CACHE_DIR / TAXI_RESULT_CACHE_MB move and size the cache
+cache_dir = Path(os.environ.get("TAXI_RESULT_CACHE_DIR", project_root / "data" / "result_cache"))
+MAX_BYTES = int(os.environ.get("TAXI_RESULT_CACHE_MB", "512")) * 1024 * 1024
+
+VERSION_TABLE = "data_version"
+
+logger = logging.getLogger(__name__)
+
+
+#marking the database contents as changed, called by the stages that write trip data
+#a random token rather than a counter, so a rebuilt or different database file never reuses one
+def bump_data_version(con, stage: str):
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {VERSION_TABLE} AS
+        SELECT uuid()::VARCHAR AS version, ?::VARCHAR AS stage, now()::TIMESTAMP AS bumped_at;
+    """, [stage])
+    logger.info("Data version bumped by %s", stage)
+
+
+#current data version of the database, or of the parquet lake for source="lake"
+#None (never written yet) turns the cache off instead of risking stale answers
+def data_version(con, source: str = "db"):
+    if source == "lake":
+        path = manifest_path()
+        if not path.exists():
+            return None
+        return "lake-" + hashlib.sha256(path.read_bytes()).hexdigest()[:16]
+    exists = con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = ?", [VERSION_TABLE]).fetchone()[0]
+    if not exists:
+        return None
+    row = con.execute(f"SELECT version FROM {VERSION_TABLE}").fetchone()
+    return row[0] if row else None
+
+
+#whitespace outside string literals does not change a query, so it does not change its key either
+def normalize_sql(sql: str):
+    parts = sql.split("'")
+    parts[::2] = [" ".join(part.split()) for part in parts[::2]]
+    return "'".join(parts).strip().rstrip(";").strip()
+
+
+def cache_key(sql: str, params, version: str):
+    #parameters keep their type in the key, so date 2024-01-01 and '2024-01-01' differ
+    bound = json.dumps(params, default=lambda value: f"{type(value).__name__}:{value}", sort_keys=True)
+    return hashlib.sha256("\n".join([version, normalize_sql(sql), bound]).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, version: str, directory: Path = None, max_bytes: int = MAX_BYTES):
+        self.version = version
+        self.directory = Path(directory or cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def entry_path(self, sql: str, params):
+        return self.directory / f"{cache_key(sql, params, self.version)}.parquet"
+
+    #running sql (or reading its cached result) on con; returns con so the caller can .df()/.fetchall()
+    def execute(self, con, sql: str, params=None):
+        params = params or []
+        path = self.entry_path(sql, params)
+        try:
+            #touching the entry keeps it at the recent end of the LRU order
+            os.utime(path)
+            hit = True
+        except FileNotFoundError:
+            hit = False
+            self.store(con, sql, params, path)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        logger.debug("Result cache %s: %s", "hit" if hit else "miss", path.name)
+        return con.execute("SELECT * FROM read_parquet(?)", [path.as_posix()])
+
+    #writing the result next to the cache and renaming it in, so readers never see a partial file
+    def store(self, con, sql: str, params, path: Path):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp_", suffix=".part")
+        os.close(fd)
+        try:
+            con.execute(f"COPY ({sql}) TO '{Path(tmp).as_posix()}' (FORMAT parquet, COMPRESSION zstd);", params)
+            os.replace(tmp, path)
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+        self.evict(keep=path)
+
+    #removing least recently used entries until the cache fits in max_bytes
+    def evict(self, keep: Path = None):
+        entries = []
+        for path in self.directory.glob("*.parquet"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.debug("Result cache evicted %s", path.name)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+#cache.execute(...) when a cache is in use, otherwise a plain con.execute(...)
+def cached_execute(cache, con, sql: str, params=None):
+    if cache is None:
+        return con.execute(sql, params or [])
+    return cache.execute(con, sql, params)
@@ -0,0 +1,149 @@
+import os
+import sys
+import logging
+import argparse
+from pathlib import Path
+from datetime import date
+
+from db import get_connection
+from lake import lake_source
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+logs_dir = project_root / "logs"
+outputs_dir = Path(os.environ.get("TAXI_OUTPUTS_DIR", project_root / "outputs"))
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROWS = 1_000_000  #rows per arrow record batch, bounds the memory a consumer holds at once
+FORMATS = {"csv": "FORMAT csv, HEADER true", "parquet": "FORMAT parquet, COMPRESSION zstd", "json": "FORMAT json"}
+
+#datasets that can be streamed or written. {source} is the trips table or the parquet lake,
+#every dataset has color and pickup_date/pickup_datetime columns so the same filters apply to all
+DATASETS = {
+    #trip level enriched rows
+    "trips": {"sql": "SELECT * FROM {source}", "time": "pickup_datetime"},
+    #color x day x hour rollup
+    "hourly": {"sql": "SELECT * FROM co2_rollup_hourly", "time": "pickup_date"},
+    #color x day totals
+    "daily": {"sql": """
+        SELECT color, pickup_date, SUM(trips) AS trips, SUM(co2_kgs) AS co2_kgs, MAX(max_co2_kgs) AS max_co2_kgs,
+               SUM(distance_mi) AS distance_mi, SUM(duration_sec) AS duration_sec
+        FROM co2_rollup_hourly {where}
+        GROUP BY ALL ORDER BY color, pickup_date
+    """, "time": "pickup_date"},
+    #color x month totals
+    "monthly": {"sql": """
+        SELECT color, date_trunc('month', pickup_date)::DATE AS month_start, SUM(trips) AS trips,
+               SUM(co2_kgs) AS co2_kgs, MAX(max_co2_kgs) AS max_co2_kgs,
+               SUM(distance_mi) AS distance_mi, SUM(duration_sec) AS duration_sec
+        FROM co2_rollup_hourly {where}
+        GROUP BY ALL ORDER BY color, month_start
+    """, "time": "pickup_date"},
+}
+
+
+#sql and parameters for one dataset, optionally filtered to a color and months = (first, last) month starts
+def dataset_query(name: str, color: str = None, months=None, source: str = "db"):
+    spec = DATASETS[name]
+    conditions, params = [], []
+    if color:
+        conditions.append("color = ?")
+        params.append(color)
+    if months:
+        conditions.append(f"{spec['time']} >= ? AND {spec['time']} < ? + INTERVAL 1 MONTH")
+        params += list(months)
+        if name == "trips" and source == "lake":
+            #the same window on the hive partition columns, so other months' files are never opened
+            conditions.append("year * 100 + month BETWEEN ? AND ?")
+            params += [m.year * 100 + m.month for m in months]
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if "{where}" in spec["sql"]:
+        return spec["sql"].format(where=where), params
+    trips = lake_source() if source == "lake" else "trips_enriched"
+    return f"{spec['sql'].format(source=trips)} {where}", params
+
+
+#connection for reading results: the database read-only, or an in-memory one over the lake
+def results_connection(name: str, source: str):
+    if source == "lake" and name == "trips":
+        return get_connection(database=":memory:")
+    return get_connection(read_only=True)
+
+
+#streaming a dataset as pyarrow RecordBatches of at most batch_size rows. nothing is turned into
+#python tuples and only one batch is held at a time, e.g.
+#    for batch in stream_batches("trips", color="green"):
+#        df = batch.to_pandas()
+def stream_batches(name: str, color: str = None, months=None, source: str = "db",
+                   batch_size: int = BATCH_ROWS, con=None):
+    owned = con is None
+    con = con or results_connection(name, source)
+    try:
+        sql, params = dataset_query(name, color, months, source)
+        reader = con.execute(sql, params).to_arrow_reader(batch_size)
+        for batch in reader:
+            yield batch
+    finally:
+        if owned:
+            con.close()
+
+
+#the same stream as pandas dataframes, one per batch
+def stream_frames(name: str, color: str = None, months=None, source: str = "db",
+                  batch_size: int = BATCH_ROWS, con=None):
+    for batch in stream_batches(name, color, months, source, batch_size, con):
+        yield batch.to_pandas()
+
+
+#writing a dataset to csv/parquet/json; duckdb streams it to the file without going through python
+def write_dataset(name: str, out_path: Path, fmt: str, color: str = None, months=None, source: str = "db"):
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    con = results_connection(name, source)
+    try:
+        sql, params = dataset_query(name, color, months, source)
+        rows = con.execute(f"COPY ({sql}) TO '{out_path.as_posix()}' ({FORMATS[fmt]});", params).fetchall()[0][0]
+    finally:
+        con.close()
+    logger.info("Wrote %s rows of %s to %s", rows, name, out_path)
+    return rows
+
+
+if __name__ == "__main__":
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename = str(logs_dir/"results.log"),
+        encoding = "utf-8",
+        filemode = "a",
+        format = "{asctime} - {levelname} - {message}",
+        style = "{",
+        datefmt = "%Y-%m-%d %H:%M",
+        level = "DEBUG"
+    )
+
+    parser = argparse.ArgumentParser(description="Write trip level data or CO2 summaries to csv/parquet/json")
+    parser.add_argument("dataset", choices=list(DATASETS), help="trips, or the hourly/daily/monthly summaries")
+    parser.add_argument("--format", choices=list(FORMATS), default="csv")
+    parser.add_argument("--out", type=Path, help="output file (default outputs/<dataset>.<format>)")
+    parser.add_argument("--color", choices=["yellow", "green"])
+    parser.add_argument("--start-month", help="first month, YYYY-MM (needs --end-month)")
+    parser.add_argument("--end-month", help="last month, YYYY-MM (needs --start-month)")
+    parser.add_argument("--source", choices=["db", "lake"], default="db", help="where trips are read from")
+    args = parser.parse_args()
+    if bool(args.start_month) != bool(args.end_month):
+        parser.error("--start-month and --end-month go together")
+
+    months = None
+    if args.start_month:
+        months = (date.fromisoformat(f"{args.start_month}-01"), date.fromisoformat(f"{args.end_month}-01"))
+    out_path = args.out or outputs_dir / f"{args.dataset}.{args.format}"
+    try:
+        rows = write_dataset(args.dataset, out_path, args.format, args.color, months, args.source)
+        print(f"Wrote {rows:,} rows to {out_path}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+        sys.exit(1)
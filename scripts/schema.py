@@ -0,0 +1,98 @@
+#explicit schema map for the 2015-2024 TLC yellow/green parquet files
+#every file is matched to a known era and projected/cast to one compact canonical schema
+#so the load no longer depends on union_by_name sniffing and upcasting at query time
+
+#canonical trips table layout, in column order
+CANONICAL_COLUMNS = [
+    ("color",            "VARCHAR"),
+    ("passenger_count",  "TINYINT"),
+    ("trip_distance",    "FLOAT"),
+    ("pickup_datetime",  "TIMESTAMP"),
+    ("dropoff_datetime", "TIMESTAMP"),
+    ("source_file",      "VARCHAR"),
+]
+
+INTEGER_TYPES = ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT")
+TIMESTAMP_TYPES = ("TIMESTAMP", "TIMESTAMP_NS", "TIMESTAMP_MS", "TIMESTAMP_S", "TIMESTAMP WITH TIME ZONE")
+
+#known layouts of the columns we read. names are matched case-insensitively
+#(VendorID/vendorid, Airport_fee/airport_fee) and each era lists the source types it allows
+SCHEMA_ERAS = [
+    {
+        #re-published TLC files up to 2022: float passenger counts, microsecond timestamps
+        "era": "2015-2022",
+        "passenger_count": ("DOUBLE",),
+        "trip_distance": ("DOUBLE",),
+        "datetime": ("TIMESTAMP", "TIMESTAMP_NS"),
+    },
+    {
+        #2023 onward: integer passenger counts, timestamp precision varies by month
+        "era": "2023-2024",
+        "passenger_count": INTEGER_TYPES,
+        "trip_distance": ("DOUBLE", "FLOAT"),
+        "datetime": TIMESTAMP_TYPES,
+    },
+]
+
+DATETIME_PREFIX = {"yellow": "tpep", "green": "lpep"}  #pickup/dropoff column prefix per color
+
+
+#{lowercase name: (actual name, duckdb type)} for one parquet file, read from metadata only
+def file_columns(con, source: str):
+    escaped = source.replace("'", "''")
+    rows = con.execute(f"DESCRIBE SELECT * FROM read_parquet('{escaped}')").fetchall()
+    return {row[0].lower(): (row[0], row[1].upper()) for row in rows}
+
+
+#source column name (lowercase) feeding each canonical column for a color
+def source_columns(color: str):
+    prefix = DATETIME_PREFIX[color]
+    return {
+        "passenger_count": "passenger_count",
+        "trip_distance": "trip_distance",
+        "pickup_datetime": f"{prefix}_pickup_datetime",
+        "dropoff_datetime": f"{prefix}_dropoff_datetime",
+    }
+
+
+#name of the first era whose columns and types match the file, None if nothing matches
+def match_era(color: str, columns: dict):
+    sources = source_columns(color)
+    for era in SCHEMA_ERAS:
+        allowed = {
+            "passenger_count": era["passenger_count"],
+            "trip_distance": era["trip_distance"],
+            "pickup_datetime": era["datetime"],
+            "dropoff_datetime": era["datetime"],
+        }
+        if all(
+            sources[col] in columns and columns[sources[col]][1] in allowed[col]
+            for col in sources
+        ):
+            return era["era"]
+    return None
+
+
+#select list that projects one file onto CANONICAL_COLUMNS (color and source_file are bound as ? params)
+def projection_sql(color: str, columns: dict):
+    sources = source_columns(color)
+    select = ["?::VARCHAR AS color"]
+    for col, col_type in CANONICAL_COLUMNS:
+        if col in sources:
+            actual = columns[sources[col]][0]
+            #out of range junk (e.g. passenger_count 300) becomes NULL and is dropped by cleaning
+            select.append(f'TRY_CAST("{actual}" AS {col_type}) AS {col}')
+    select.append("?::VARCHAR AS source_file")
+    return ",\n            ".join(select)
+
+
+#WHERE clause keeping pickups inside [start, end), both bound as ? params. it compares the raw
+#parquet column so duckdb pushes it into the scan and skips row groups by their min/max statistics
+def pickup_window_sql(color: str, columns: dict):
+    actual = columns[source_columns(color)["pickup_datetime"]][0]
+    return f'"{actual}" >= ?::TIMESTAMP AND "{actual}" < ?::TIMESTAMP'
+
+
+#column definitions for CREATE TABLE
+def canonical_ddl():
+    return ",\n            ".join(f"{col:<16} {col_type}" for col, col_type in CANONICAL_COLUMNS)
@@ -0,0 +1,135 @@
+import duckdb
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+
+#synthetic NYC taxi monthly parquet files for offline benchmarks
+#column names/types follow the real TLC layout of each era, and a few percent of rows are the
+#dirty cases scripts/clean.py removes (0 passengers, 0 or >100 miles, >1 day, duplicates, ...)
+
+#paths
+script_dir = Path(__file__).resolve().parent
+project_root = script_dir.parent
+
+logger = logging.getLogger(__name__)
+
+BASE_ROWS = 10_000  #rows per monthly file at scale factor 1
+DATETIME_PREFIX = {"yellow": "tpep", "green": "lpep"}
+
+
+#pseudo random integer in [0, n) for row i, deterministic for a given seed
+def rand(n: int, salt: int):
+    return f"(hash(i, {salt}, $seed) % {n})"
+
+
+#(column name, sql expression) pairs for one color/year, in the file's column order
+def layout(color: str, year: int):
+    prefix = DATETIME_PREFIX[color]
+    #passenger counts were floats in the re-published 2015-2022 files and integers from 2023
+    passenger_type = "BIGINT" if year >= 2023 else "DOUBLE"
+    vendor_type = "INTEGER" if year >= 2024 else "BIGINT"
+
+    columns = [
+        ("VendorID", f"(1 + {rand(2, 1)})::{vendor_type}"),
+        (f"{prefix}_pickup_datetime", "pickup::TIMESTAMP"),
+        (f"{prefix}_dropoff_datetime", "dropoff::TIMESTAMP"),
+        ("passenger_count", f"passengers::{passenger_type}"),
+        ("trip_distance", "distance::DOUBLE"),
+        ("RatecodeID", f"(1 + {rand(5, 2)})::DOUBLE"),
+        ("store_and_fwd_flag", f"CASE WHEN {rand(50, 3)} = 0 THEN 'Y' ELSE 'N' END"),
+        ("PULocationID", f"(1 + {rand(263, 4)})::INTEGER"),
+        ("DOLocationID", f"(1 + {rand(263, 5)})::INTEGER"),
+        ("payment_type", f"(1 + {rand(4, 6)})::BIGINT"),
+        ("fare_amount", "round(3 + distance * 2.5, 2)::DOUBLE"),
+        ("extra", "0.5::DOUBLE"),
+        ("mta_tax", "0.5::DOUBLE"),
+        ("tip_amount", f"round({rand(500, 7)} / 100.0, 2)::DOUBLE"),
+        ("tolls_amount", "0.0::DOUBLE"),
+        ("improvement_surcharge", "0.3::DOUBLE"),
+        ("total_amount", "round(4.3 + distance * 2.5, 2)::DOUBLE"),
+    ]
+    if color == "green":
+        columns.insert(5, ("ehail_fee", "NULL::DOUBLE"))
+        columns.append(("trip_type", f"(1 + {rand(2, 8)})::DOUBLE"))
+    if year >= 2019:
+        columns.append(("congestion_surcharge", "2.5::DOUBLE"))
+    if color == "yellow" and year >= 2021:
+        #the airport fee column changed casing along the way
+        columns.append(("Airport_fee" if year == 2023 else "airport_fee", "0.0::DOUBLE"))
+    return columns
+
+
+#seed of one file, mixed from the dataset seed, color, year and month so every file gets its own
+#trips (and months and colors their own totals) while the whole dataset stays reproducible
+def file_seed(seed: int, color: str, year: int, month: int):
+    digest = hashlib.blake2b(f"{seed}/{color}/{year}-{month:02d}".encode(), digest_size=4).digest()
+    return int.from_bytes(digest, "little")
+
+
+#writing one synthetic month to out_dir/{color}_tripdata_{year}-{month}.parquet
+def generate_month(con, color: str, year: int, month: int, rows: int, out_dir: Path, seed: int = 42):
+    out_path = Path(out_dir) / f"{color}_tripdata_{year}-{month:02d}.parquet"
+    select = ",\n            ".join(f'{expr} AS "{name}"' for name, expr in layout(color, year))
+    con.execute(f"""
+        COPY (
+            WITH base AS (
+                SELECT
+                    i,
+                    make_timestamp($year, $month, 1, 0, 0, 0)
+                        + to_seconds({rand(28 * 86400, 10)}) AS clean_pickup,
+                    60 + {rand(3600, 11)}                    AS clean_duration,
+                    (1 + {rand(4, 12)})                      AS clean_passengers,
+                    round(0.3 + {rand(2000, 13)} / 100.0, 2) AS clean_distance
+                FROM range($rows) t(i)
+            ),
+            trips AS (
+                --i % 100 picks the dirty cases, everything else is a normal trip
+                SELECT
+                    i,
+                    CASE WHEN i % 100 = 6 THEN clean_pickup - INTERVAL 400 DAY ELSE clean_pickup END AS pickup,
+                    CASE
+                        WHEN i % 100 = 3 THEN clean_pickup + INTERVAL 2 DAY
+                        WHEN i % 100 = 4 THEN clean_pickup - INTERVAL 10 MINUTE
+                        WHEN i % 100 = 6 THEN clean_pickup - INTERVAL 400 DAY + to_seconds(clean_duration)
+                        ELSE clean_pickup + to_seconds(clean_duration)
+                    END AS dropoff,
+                    CASE WHEN i % 100 = 0 THEN 0 WHEN i % 100 = 5 THEN NULL ELSE clean_passengers END AS passengers,
+                    CASE WHEN i % 100 = 1 THEN 0 WHEN i % 100 = 2 THEN 150 + clean_distance ELSE clean_distance END AS distance
+                FROM base
+            )
+            SELECT {select} FROM trips
+            UNION ALL
+            --exact duplicates of 1% of the trips
+            SELECT {select} FROM trips WHERE i % 100 = 50
+        ) TO '{out_path.as_posix()}' (FORMAT parquet);
+    """, {"year": year, "month": month, "rows": rows, "seed": seed})
+    return out_path
+
+
+#writing every month of years x colors, returns the list of files
+def generate_dataset(out_dir: Path, years, colors=("yellow", "green"), scale: float = 1.0, seed: int = 42):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    rows = max(int(BASE_ROWS * scale), 100)
+    con = duckdb.connect()
+    try:
+        files = [
+            generate_month(con, color, year, month, rows, out_dir, file_seed(seed, color, year, month))
+            for color in colors for year in years for month in range(1, 13)
+        ]
+    finally:
+        con.close()
+    logger.info("Generated %s synthetic files (%s rows each) in %s", len(files), rows, out_dir)
+    return files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic NYC taxi parquet files")
+    parser.add_argument("out_dir", type=Path, help="directory to write the parquet files into")
+    parser.add_argument("--years", type=int, nargs="+", default=list(range(2015, 2025)))
+    parser.add_argument("--scale", type=float, default=1.0, help=f"scale factor, 1 = {BASE_ROWS:,} trips per file")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    files = generate_dataset(args.out_dir, args.years, scale=args.scale, seed=args.seed)
+    print(f"Wrote {len(files)} files to {args.out_dir}")
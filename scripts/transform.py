@@ -1,3 +1,289 @@
-import duckdb
+import sys
 import logging
-#using dbt for transform section
\ No newline at end of file
+import argparse
+#python transform below; the same steps also exist as incremental dbt models in dbt/models
+
+from approx import SAMPLE_SIZE
+from db import get_connection
+from emissions import MONTH_FACTORS_SQL, factor_expression, month_factors
+from profiling import StageReport
+from result_cache import bump_data_version
+
+
+logging.basicConfig(
+    filename = "logs/transform.log",
+    encoding = "utf-8",
+    filemode = "a",
+    format = "{asctime} - {levelname} - {message}",
+    style = "{",
+    datefmt = "%Y-%m-%d %H:%M",
+    level = "DEBUG"
+)
+logger = logging.getLogger(__name__)
+
+CLEAN_TABLE = "trips_clean"        #cleaned trips from scripts/clean.py
+ENRICHED_TABLE = "trips_enriched"  #trip level output
+ROLLUP_TABLE = "co2_rollup_hourly" #color x day x hour aggregates read by scripts/analysis.py
+SAMPLE_TABLE = "trips_sample"      #reservoir sample per (month, color) for analysis --approx
+STRATA_TABLE = "trips_sample_strata"
+
+
+#creating the enriched table and the partition manifest if this is the first run
+def ensure_tables(con):
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ENRICHED_TABLE} (
+            color             VARCHAR,
+            passenger_count   TINYINT,
+            trip_distance     FLOAT,
+            pickup_datetime   TIMESTAMP,
+            dropoff_datetime  TIMESTAMP,
+            trip_duration_sec BIGINT,
+            trip_co2_kgs      DOUBLE,
+            avg_mph           DOUBLE,
+            hour_of_day       TINYINT,
+            day_of_week       TINYINT,
+            week_of_year      TINYINT,
+            month_of_year     TINYINT
+        );
+    """)
+    #persistent pre-aggregation of trips_enriched, kept in step with it partition by partition
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            color        VARCHAR,
+            pickup_date  DATE,
+            hour_of_day  TINYINT,
+            trips        BIGINT,
+            co2_kgs      DOUBLE,
+            max_co2_kgs  DOUBLE,
+            distance_mi  DOUBLE,
+            duration_sec BIGINT
+        );
+    """)
+    #up to SAMPLE_SIZE random trips of every (month, color) partition, redrawn whenever it is rebuilt
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SAMPLE_TABLE} (
+            color           VARCHAR,
+            month_start     DATE,
+            pickup_datetime TIMESTAMP,
+            co2             DOUBLE
+        );
+    """)
+    #size of each sampled partition (the stratum weights) and its exact largest trip
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STRATA_TABLE} (
+            color        VARCHAR,
+            month_start  DATE,
+            population   BIGINT,
+            sample_size  BIGINT,
+            max_co2      DOUBLE
+        );
+    """)
+    #what each (month, color) partition of trips_enriched was built from
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS transform_manifest (
+            month_start        DATE,
+            color              VARCHAR,
+            rows_out           BIGINT,
+            content_hash       UBIGINT,
+            factor_version     VARCHAR,
+            built_at           TIMESTAMP,
+            PRIMARY KEY (month_start, color)
+        );
+    """)
+    #manifests from before the versioned emissions dimension rebuild once
+    con.execute("ALTER TABLE transform_manifest ADD COLUMN IF NOT EXISTS factor_version VARCHAR;")
+
+
+#(month, color) partitions whose cleaned rows or emissions factors differ from the last build
+#months without any emissions factor range are left out
+#color-major order, so a fresh build writes trips_enriched clustered by (color, pickup_datetime) like trips_clean
+def changed_partitions(con):
+    return con.execute(f"""
+        WITH factors AS ({MONTH_FACTORS_SQL})
+        SELECT s.month_start, s.color, s.rows_out, s.content_hash, f.factor_version
+        FROM clean_rule_summary s
+        JOIN factors f USING (month_start, color)
+        LEFT JOIN transform_manifest m USING (month_start, color)
+        LEFT JOIN {STRATA_TABLE} st USING (month_start, color)
+        WHERE s.month_start IS NOT NULL
+          AND s.rows_out > 0
+          AND (m.month_start IS NULL
+               OR st.month_start IS NULL
+               OR m.rows_out IS DISTINCT FROM s.rows_out
+               OR m.content_hash IS DISTINCT FROM s.content_hash
+               OR m.factor_version IS DISTINCT FROM f.factor_version)
+        ORDER BY s.color, s.month_start
+    """).fetchall()
+
+
+#partitions that were built before but no longer have any cleaned rows
+def stale_partitions(con):
+    return con.execute("""
+        SELECT m.month_start, m.color
+        FROM transform_manifest m
+        LEFT JOIN clean_rule_summary s
+          ON s.month_start = m.month_start AND s.color = m.color AND s.rows_out > 0
+        WHERE s.month_start IS NULL
+    """).fetchall()
+
+
+#dropping one (month, color) partition from the enriched table, the rollup, the sample and the manifest
+def delete_partition(con, month_start, color):
+    con.execute(f"""
+        DELETE FROM {ENRICHED_TABLE}
+        WHERE color = $color
+          AND pickup_datetime >= $month AND pickup_datetime < $month + INTERVAL 1 MONTH;
+    """, {"color": color, "month": month_start})
+    con.execute(f"""
+        DELETE FROM {ROLLUP_TABLE}
+        WHERE color = $color
+          AND pickup_date >= $month AND pickup_date < $month + INTERVAL 1 MONTH;
+    """, {"color": color, "month": month_start})
+    for table in (SAMPLE_TABLE, STRATA_TABLE):
+        con.execute(f"DELETE FROM {table} WHERE month_start = ? AND color = ?;", [month_start, color])
+    con.execute("DELETE FROM transform_manifest WHERE month_start = ? AND color = ?;", [month_start, color])
+
+
+#rebuilding one (month, color) partition in a single set-based INSERT ... SELECT
+def build_partition(con, month_start, color, rows_out, content_hash, factor_version):
+    #co2 factors come from the emissions dimension, not a hard-coded number. they are resolved
+    #once per month and broadcast into the scan instead of joining every trip to the dimension
+    factor_sql, factor_params = factor_expression(month_factors(con, color, month_start), month_start)
+    con.execute("BEGIN TRANSACTION;")
+    try:
+        delete_partition(con, month_start, color)
+        rows = con.execute(f"""
+            INSERT INTO {ENRICHED_TABLE}
+            SELECT
+              t.color, t.passenger_count, t.trip_distance, t.pickup_datetime, t.dropoff_datetime,
+              t.trip_duration_sec,
+              t.trip_distance * {factor_sql} / 1000.0                            AS trip_co2_kgs,
+              t.trip_distance / nullif(t.trip_duration_sec / 3600.0, 0)          AS avg_mph,
+              hour(t.pickup_datetime)                                            AS hour_of_day,
+              dayofweek(t.pickup_datetime)                                       AS day_of_week,   -- 0=Sun..6=Sat
+              week(t.pickup_datetime)                                            AS week_of_year,
+              month(t.pickup_datetime)                                           AS month_of_year
+            FROM {CLEAN_TABLE} t
+            WHERE t.color = $color
+              AND t.pickup_datetime >= $month AND t.pickup_datetime < $month + INTERVAL 1 MONTH
+            ORDER BY t.pickup_datetime;
+        """, {"color": color, "month": month_start, **factor_params}).fetchone()[0]
+        #rolling the fresh partition up to day x hour so analysis never has to scan trips
+        con.execute(f"""
+            INSERT INTO {ROLLUP_TABLE}
+            SELECT
+              color,
+              DATE(pickup_datetime)  AS pickup_date,
+              hour_of_day,
+              COUNT(*)               AS trips,
+              SUM(trip_co2_kgs)      AS co2_kgs,
+              MAX(trip_co2_kgs)      AS max_co2_kgs,
+              SUM(trip_distance)     AS distance_mi,
+              SUM(trip_duration_sec) AS duration_sec
+            FROM {ENRICHED_TABLE}
+            WHERE color = $color
+              AND pickup_datetime >= $month AND pickup_datetime < $month + INTERVAL 1 MONTH
+            GROUP BY ALL;
+        """, {"color": color, "month": month_start})
+        #fresh reservoir sample of the partition and its stratum size. the seed differs per partition:
+        #partitions are sorted by pickup, a shared seed would pick the same positions in every month
+        seed = month_start.year * 100 + month_start.month + (0 if color == "yellow" else 1_000_000)
+        con.execute(f"""
+            INSERT INTO {SAMPLE_TABLE}
+            SELECT color, $month, pickup_datetime, trip_co2_kgs
+            FROM (
+                SELECT color, pickup_datetime, trip_co2_kgs
+                FROM {ENRICHED_TABLE}
+                WHERE color = $color
+                  AND pickup_datetime >= $month AND pickup_datetime < $month + INTERVAL 1 MONTH
+            ) USING SAMPLE reservoir({SAMPLE_SIZE} ROWS) REPEATABLE ({seed});
+        """, {"color": color, "month": month_start})
+        con.execute(f"""
+            INSERT INTO {STRATA_TABLE}
+            SELECT
+              $color, $month, $rows,
+              (SELECT COUNT(*) FROM {SAMPLE_TABLE} WHERE color = $color AND month_start = $month),
+              (SELECT MAX(max_co2_kgs) FROM {ROLLUP_TABLE}
+               WHERE color = $color AND pickup_date >= $month AND pickup_date < $month + INTERVAL 1 MONTH);
+        """, {"color": color, "month": month_start, "rows": rows})
+        con.execute("""
+            INSERT INTO transform_manifest (month_start, color, rows_out, content_hash, factor_version, built_at)
+            VALUES (?, ?, ?, ?, ?, now()::TIMESTAMP);
+        """, [month_start, color, rows_out, content_hash, factor_version])
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    return rows
+
+
+#building trips_enriched from the cleaned trips, one month partition at a time
+def transform_trips(full_refresh: bool = False, profile: bool = False):
+
+    con = None
+    report = StageReport("transform", profile)
+
+    try:
+        # Connect to local DuckDB instance
+        con = get_connection()
+        logger.info("Connected to DuckDB instance for TRANSFORMING")
+
+        if full_refresh:
+            con.execute(f"DROP TABLE IF EXISTS {ENRICHED_TABLE};")
+            con.execute(f"DROP TABLE IF EXISTS {ROLLUP_TABLE};")
+            con.execute(f"DROP TABLE IF EXISTS {SAMPLE_TABLE};")
+            con.execute(f"DROP TABLE IF EXISTS {STRATA_TABLE};")
+            con.execute("DROP TABLE IF EXISTS transform_manifest;")
+            logger.info("Full refresh requested, dropped %s, %s, %s and transform_manifest",
+                        ENRICHED_TABLE, ROLLUP_TABLE, SAMPLE_TABLE)
+        ensure_tables(con)
+
+        #months that disappeared from the cleaned data
+        stale = stale_partitions(con)
+        for month_start, color in stale:
+            delete_partition(con, month_start, color)
+            logger.info("Removed stale partition %s %s", color, month_start)
+
+        #only partitions whose cleaned input or emissions factors changed are rebuilt
+        partitions = changed_partitions(con)
+        if stale or partitions:
+            bump_data_version(con, "transform")
+        total_rows = 0
+        for month_start, color, rows_out, content_hash, factor_version in partitions:
+            with report.step(f"build {color} {month_start}") as record:
+                rows = build_partition(con, month_start, color, rows_out, content_hash, factor_version)
+                record["rows_in"], record["rows_out"] = rows_out, rows
+            total_rows += rows
+            logger.info("Built partition %s %s (%s rows)", color, month_start, rows)
+
+        enriched_count = con.execute(f"SELECT COUNT(*) FROM {ENRICHED_TABLE}").fetchone()[0]
+        rollup_count = con.execute(f"SELECT COUNT(*) FROM {ROLLUP_TABLE}").fetchone()[0]
+        report.set_total("partitions_rebuilt", len(partitions))
+        report.set_total("rows_out", total_rows)
+
+        print(f"Partitions rebuilt: {len(partitions)}, removed: {len(stale)}, rows written: {total_rows:,}")
+        print(f"Rows {ENRICHED_TABLE}: {enriched_count:,}")
+        print(f"Rows {ROLLUP_TABLE}: {rollup_count:,}")
+        logger.info("Partitions rebuilt=%s, removed=%s, rows written=%s", len(partitions), len(stale), total_rows)
+        logger.info("%s row count: %s", ENRICHED_TABLE, enriched_count)
+        logger.info("%s row count: %s", ROLLUP_TABLE, rollup_count)
+
+        con.close()
+        return True
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        logger.error(f"An error occurred: {e}")
+        return False
+
+    finally:
+        logger.info("Run report written to %s", report.write())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build trips_enriched from trips_clean")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="drop trips_enriched and its manifest and rebuild every partition")
+    parser.add_argument("--profile", action="store_true", help="include duckdb query profiles in the run report")
+    args = parser.parse_args()
+    ok = transform_trips(full_refresh=args.full_refresh, profile=args.profile)
+    sys.exit(0 if ok else 1)
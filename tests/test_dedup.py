@@ -0,0 +1,146 @@
+import os
+from datetime import date
+
+import duckdb
+import numpy as np
+import pytest
+
+import dedup
+from dedup import ChunkedDedup
+
+
+MONTH = date(2023, 3, 1)
+
+
+#a small trips_all month: passing trips, a copy of every tenth one, near duplicates that differ
+#in one column only, rows failing the cleaning rules, and a few trips from the next month
+def make_trips(con, rows: int = 3000):
+    con.execute("""
+        CREATE TABLE trips_all (
+            color VARCHAR, passenger_count TINYINT, trip_distance FLOAT,
+            pickup_datetime TIMESTAMP, dropoff_datetime TIMESTAMP, source_file VARCHAR
+        );
+    """)
+    con.execute("""
+        INSERT INTO trips_all
+        SELECT
+          CASE WHEN i % 2 = 0 THEN 'yellow' ELSE 'green' END,
+          CASE WHEN i % 50 = 0 THEN 0 ELSE 1 + i % 4 END,
+          CASE WHEN i % 70 = 0 THEN 0 ELSE (i % 97) / 10.0 + 0.1 END,
+          TIMESTAMP '2023-03-01' + INTERVAL (i * 797 % 2419200) SECOND,
+          TIMESTAMP '2023-03-01' + INTERVAL (i * 797 % 2419200 + 300 + i % 1800) SECOND,
+          'file_' || (i % 3)
+        FROM range(?) t(i);
+    """, [rows])
+    #exact duplicates, loaded from another file
+    con.execute("INSERT INTO trips_all SELECT * REPLACE ('dup_file' AS source_file) FROM trips_all USING SAMPLE 10% (bernoulli, 7);")
+    #near duplicates: same trip, one value changed, must all be kept
+    con.execute("INSERT INTO trips_all SELECT * REPLACE (trip_distance + 0.5 AS trip_distance) FROM trips_all LIMIT 50;")
+    con.execute("INSERT INTO trips_all SELECT * REPLACE ('green' AS color) FROM trips_all WHERE color = 'yellow' LIMIT 50;")
+    #outside the month being cleaned
+    con.execute("INSERT INTO trips_all SELECT * REPLACE (pickup_datetime + INTERVAL 40 DAY AS pickup_datetime) FROM trips_all LIMIT 20;")
+
+
+#cleaning MONTH with one engine on a fresh database; returns the connection
+@pytest.fixture
+def cleaned(tmp_path, monkeypatch):
+    #clean.py logs to logs/clean.log relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("logs", exist_ok=True)
+    import clean
+
+    connections = []
+
+    def run(engine=None):
+        con = duckdb.connect()
+        make_trips(con)
+        rows_in = con.execute("SELECT COUNT(*) FROM trips_all").fetchone()[0]
+        clean.create_clean_tables(con)
+        clean.clean_month(con, MONTH, engine, rows_in)
+        connections.append(con)
+        return con
+
+    yield run
+    for con in connections:
+        con.close()
+
+
+#rows in one table but not the other, in both directions, counting repeats
+def differences(a, b, table: str):
+    probe = duckdb.connect()
+    probe.register("a", a.execute(f"SELECT * FROM {table}").arrow())
+    probe.register("b", b.execute(f"SELECT * FROM {table}").arrow())
+    missing = probe.execute("SELECT COUNT(*) FROM (FROM a EXCEPT ALL FROM b)").fetchone()[0]
+    extra = probe.execute("SELECT COUNT(*) FROM (FROM b EXCEPT ALL FROM a)").fetchone()[0]
+    probe.close()
+    return missing, extra
+
+
+def assert_same_clean(sql_con, chunked_con):
+    for table in ("trips_clean", "trips_rejected", "clean_rule_summary"):
+        assert differences(sql_con, chunked_con, table) == (0, 0), table
+
+
+def test_chunked_matches_sql_in_memory(cleaned):
+    sql_con = cleaned()
+    chunked = ChunkedDedup("256MB")
+    chunked_con = cleaned(chunked)
+    assert chunked.partitions_spilled == 0
+    assert_same_clean(sql_con, chunked_con)
+    assert sql_con.execute("SELECT SUM(duplicates) FROM clean_rule_summary").fetchone()[0] > 0
+
+
+def test_chunked_matches_sql_when_spilling(cleaned):
+    sql_con = cleaned()
+    #a tiny budget spreads the month over several spill partitions
+    chunked = ChunkedDedup("100KB")
+    chunked_con = cleaned(chunked)
+    assert chunked.partitions_spilled > 1
+    assert chunked.bytes_spilled > 0
+    assert_same_clean(sql_con, chunked_con)
+
+
+def test_fingerprint_collisions_keep_distinct_trips(cleaned, monkeypatch):
+    sql_con = cleaned()
+    #every row gets the same fingerprint, so every row goes through the exact comparison
+    monkeypatch.setattr(dedup, "fingerprints", lambda table, columns=dedup.KEY_COLUMNS:
+                        np.zeros(table.num_rows, dtype=np.uint64))
+    for budget in ("256MB", "100KB"):
+        chunked_con = cleaned(ChunkedDedup(budget))
+        assert_same_clean(sql_con, chunked_con)
+
+
+def test_fingerprints_equal_for_equal_rows():
+    con = duckdb.connect()
+    table = con.execute("""
+        SELECT * FROM (VALUES
+          ('yellow', 1::TINYINT, 1.5::FLOAT, TIMESTAMP '2023-03-01 10:00', TIMESTAMP '2023-03-01 10:10'),
+          ('yellow', 1::TINYINT, 1.5::FLOAT, TIMESTAMP '2023-03-01 10:00', TIMESTAMP '2023-03-01 10:10'),
+          ('green',  1::TINYINT, 1.5::FLOAT, TIMESTAMP '2023-03-01 10:00', TIMESTAMP '2023-03-01 10:10'),
+          ('yellow', NULL,       1.5::FLOAT, TIMESTAMP '2023-03-01 10:00', TIMESTAMP '2023-03-01 10:10')
+        ) t(color, passenger_count, trip_distance, pickup_datetime, dropoff_datetime)
+    """).arrow()
+    table = table.read_all() if hasattr(table, "read_all") else table
+    fp = dedup.fingerprints(table)
+    assert fp[0] == fp[1]
+    assert len(set(fp[1:].tolist())) == 3
+    assert dedup.distinct_rows(table, fp).num_rows == 3
+
+
+def test_partition_count_keeps_the_memory_ceiling():
+    chunked = ChunkedDedup("1MB")
+    assert chunked.partition_count(0) == 1
+    count = chunked.partition_count(50_000)
+    assert count & (count - 1) == 0
+    assert 50_000 / count * dedup.ROW_BYTES * dedup.WORK_FACTOR <= chunked.memory_bytes
+    #more partitions than MAX_PARTITIONS would be needed: refuse instead of exceeding the budget
+    with pytest.raises(ValueError):
+        chunked.partition_count(100_000_000)
+
+
+def test_parse_bytes():
+    assert dedup.parse_bytes("256MB") == 256_000_000
+    assert dedup.parse_bytes("2GiB") == 2 * 1024 ** 3
+    assert dedup.parse_bytes("1000") == 1000
+    with pytest.raises(ValueError):
+        dedup.parse_bytes("lots")
@@ -0,0 +1,157 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import download
+
+
+NAME = "yellow_tripdata_2023-03.parquet"
+
+
+#a small generated parquet file; different seeds give different bytes of the same size
+def parquet_bytes(seed: int = 0, rows: int = 5000):
+    table = pa.table({"trip_distance": [float((i * 7 + seed) % 97) for i in range(rows)],
+                      "passenger_count": [(i + seed) % 4 for i in range(rows)]})
+    sink = io.BytesIO()
+    pq.write_table(table, sink, compression="none")
+    return sink.getvalue()
+
+
+#stand-in for the CDN: HEAD with size/ETag/Last-Modified, GET honouring Range and If-Range
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_headers(self, status, body, version, content_range=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", version["etag"])
+        self.send_header("Last-Modified", version["last_modified"])
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        files, requests = self.server.files, self.server.requests
+        requests.append(("HEAD", self.path, dict(self.headers)))
+        if self.path.lstrip("/") not in files:
+            self.send_error(404)
+            return
+        version = files[self.path.lstrip("/")]
+        self.send_headers(200, version["body"], version)
+
+    def do_GET(self):
+        files, requests = self.server.files, self.server.requests
+        requests.append(("GET", self.path, dict(self.headers)))
+        version = files[self.path.lstrip("/")]
+        body = version["body"]
+        byte_range = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        #a range is only served when the file is still the version the client started from
+        if byte_range and if_range in (None, version["etag"], version["last_modified"]):
+            start = int(byte_range.split("=")[1].rstrip("-"))
+            self.send_headers(206, body[start:], version, f"bytes {start}-{len(body) - 1}/{len(body)}")
+            self.wfile.write(body[start:])
+            self.server.sent.append(len(body) - start)
+            return
+        self.send_headers(200, body, version)
+        self.wfile.write(body)
+        self.server.sent.append(len(body))
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    httpd.files, httpd.requests, httpd.sent = {}, [], []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    def publish(body: bytes, etag: str, last_modified: str = "Wed, 01 Mar 2023 00:00:00 GMT"):
+        httpd.files[NAME] = {"body": body, "etag": etag, "last_modified": last_modified}
+
+    httpd.publish = publish
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/{NAME}"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def gets(server):
+    return [headers for method, _, headers in server.requests if method == "GET"]
+
+
+def test_fresh_download(server, tmp_path):
+    body = parquet_bytes()
+    server.publish(body, '"v1"')
+    path = download.download_file(server.url, tmp_path)
+    assert path.read_bytes() == body
+    assert download.read_meta(path)["etag"] == '"v1"'
+    assert not (tmp_path / (NAME + ".part")).exists()
+    assert "Range" not in gets(server)[0]
+
+
+#a .part file left by an interrupted download of version v1
+def interrupted(server, tmp_path, body, etag):
+    server.publish(body, etag)
+    part = tmp_path / (NAME + ".part")
+    part.write_bytes(body[:len(body) // 2])
+    download.write_meta(part, download.remote_info(server.url))
+    server.requests.clear()
+    return len(body) // 2
+
+
+def test_resume_from_truncated_part(server, tmp_path):
+    body = parquet_bytes()
+    half = interrupted(server, tmp_path, body, '"v1"')
+    path = download.download_file(server.url, tmp_path)
+    assert path.read_bytes() == body
+    request = gets(server)[0]
+    assert request["Range"] == f"bytes={half}-"
+    assert request["If-Range"] == '"v1"'
+    #only the missing tail went over the wire
+    assert server.sent == [len(body) - half]
+    assert not download.meta_path(tmp_path / (NAME + ".part")).exists()
+
+
+def test_resume_restarts_when_the_file_changed(server, tmp_path):
+    old, new = parquet_bytes(0), parquet_bytes(1)
+    interrupted(server, tmp_path, old, '"v1"')
+    #republished at the same size before the download resumed: appending would splice two versions
+    server.publish(new, '"v2"')
+    path = download.download_file(server.url, tmp_path)
+    assert path.read_bytes() == new
+    assert "Range" not in gets(server)[0]
+
+
+def test_unchanged_file_is_not_downloaded_again(server, tmp_path):
+    server.publish(parquet_bytes(), '"v1"')
+    download.download_file(server.url, tmp_path)
+    server.requests.clear()
+    path = download.download_file(server.url, tmp_path)
+    assert path.exists()
+    assert [method for method, _, _ in server.requests] == ["HEAD"]
+
+
+def test_changed_etag_downloads_again(server, tmp_path):
+    old, new = parquet_bytes(0), parquet_bytes(1)
+    assert len(old) == len(new) and old != new
+    server.publish(old, '"v1"')
+    download.download_file(server.url, tmp_path)
+    #republished at the same size and Last-Modified, only the ETag tells them apart
+    server.publish(new, '"v2"')
+    path = download.download_file(server.url, tmp_path)
+    assert path.read_bytes() == new
+    assert download.read_meta(path)["etag"] == '"v2"'
+    assert len(gets(server)) == 2
+
+
+def test_corrupt_download_is_rejected(server, tmp_path):
+    server.publish(b"not a parquet file", '"v1"')
+    with pytest.raises(ValueError):
+        download.download_file(server.url, tmp_path)
+    assert not (tmp_path / NAME).exists()
+    assert not (tmp_path / (NAME + ".part")).exists()